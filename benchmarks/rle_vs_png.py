@@ -0,0 +1,90 @@
+"""
+Compares the RLE output with png label maps: size, encoding and decoding time per mask type.
+
+    python benchmarks/rle_vs_png.py --input_dir 'pages/*.xml' --setting all_types baseline text_line
+"""
+import argparse
+import io
+import json
+import time
+from collections import defaultdict
+
+import numpy as np
+from PIL import Image
+
+from pagexml_mask_converter import rle
+from pagexml_mask_converter.discovery import iter_inputs
+from pagexml_mask_converter.pagexml_to_mask import MaskGenerator, MaskSetting, MaskType, parse_page_xml
+
+
+def measure(mask: Image, repeat: int):
+    stats = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        buffer = io.BytesIO()
+        mask.save(buffer, format='png')
+    stats['png_encode'] = (time.perf_counter() - start) / repeat
+    png = buffer.getvalue()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        png_labels = np.array(Image.open(io.BytesIO(png)))
+    stats['png_decode'] = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encoded = json.dumps(rle.encode(np.asarray(mask))).encode('utf-8')
+    stats['rle_encode'] = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        rle_labels = rle.decode(json.loads(encoded))
+    stats['rle_decode'] = (time.perf_counter() - start) / repeat
+
+    if not (rle_labels == png_labels).all():
+        raise AssertionError("RLE and png decode to different label maps")
+    stats['png_bytes'] = len(png)
+    stats['rle_bytes'] = len(encoded)
+    stats['raw_bytes'] = png_labels.nbytes
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_dir", type=str, required=True,
+                        help="Directory of PageXML files or a glob pattern of them")
+    parser.add_argument('--setting', default=['all_types', 'baseline'], nargs='+',
+                        choices=[mask_type.value for mask_type in MaskType])
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=3, help="Timing repetitions per mask")
+    parser.add_argument('--output', type=str, default=None, help="Json file for the results")
+    args = parser.parse_args()
+
+    mask_types = [MaskType(setting) for setting in args.setting]
+    mask_gen = MaskGenerator(MaskSetting(MASK_TYPE=mask_types[0], LABEL_MAP=True), mask_types=mask_types)
+    totals = defaultdict(lambda: defaultdict(float))
+    for file in iter_inputs(args.input_dir):
+        page = parse_page_xml(file, mask_types)
+        for mask_type in mask_types:
+            stats = measure(mask_gen.render(page, mask_type, args.scale), args.repeat)
+            totals[mask_type.value]['masks'] += 1
+            for key, value in stats.items():
+                totals[mask_type.value][key] += value
+
+    results = {}
+    for mask_type, total in totals.items():
+        results[mask_type] = {
+            'masks': int(total['masks']),
+            'png_ratio': total['raw_bytes'] / total['png_bytes'],
+            'rle_ratio': total['raw_bytes'] / total['rle_bytes'],
+            'rle_bytes_per_png_byte': total['rle_bytes'] / total['png_bytes'],
+            **{key + '_ms': 1000 * total[key] / total['masks']
+               for key in ('png_encode', 'png_decode', 'rle_encode', 'rle_decode')},
+        }
+    text = json.dumps(results, indent=4)
+    print(text)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Benchmarks parsing, rasterizing, encoding and the whole command line conversion on a synthetic corpus and
+writes the results as json, to compare them between versions:
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --output new.json --compare results.json
+
+The corpus covers the namespaces of every PCGTS version. Times are the best of --repeat runs.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import replace
+
+import numpy as np
+import PIL
+
+from pagexml_mask_converter.pagexml_to_mask import MaskGenerator, MaskSetting, MaskType, page_region_to_mask, \
+    parse_page_xml
+from pagexml_mask_converter.rasterizer import RasterizerBackend
+from pagexml_mask_converter.synthetic import SyntheticPageConfig, write_corpus
+
+
+def best_time(function, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def reference_parse(file, mask_type):
+    """
+    Polygons of mask_type the way the converter read them before the streaming parser: ElementTree.parse of
+    the whole file and find/findall below the Page, the reference bench_parse compares with.
+    """
+    root = ET.parse(file).getroot()
+    namespaces = {'pcgts': root.tag[1:].split('}')[0]}
+    page = root.find('pcgts:Page', namespaces)
+    polygons = []
+    for region in page:
+        if mask_type in (MaskType.ALLTYPES, MaskType.TEXT_NONTEXT):
+            coords = region.find('pcgts:Coords', namespaces)
+            if coords is not None:
+                polygons.append([tuple(map(int, point.split(','))) for point in coords.get('points').split()])
+        else:
+            tag = 'pcgts:Coords' if mask_type is MaskType.TEXT_LINE else 'pcgts:Baseline'
+            for line in region.findall('pcgts:TextLine', namespaces):
+                element = line.find(tag, namespaces)
+                if element is not None:
+                    polygons.append([tuple(map(int, point.split(','))) for point in element.get('points').split()])
+    return polygons
+
+
+def bench_parse(files, mask_types, repeat):
+    """
+    parse_page_xml per mask type compared to reference_parse, speedup > 1 is faster than the reference.
+    """
+    seconds = best_time(lambda: [parse_page_xml(file, list(MaskType)) for file in files], repeat)
+    results = {'all': {'seconds': seconds, 'pages_per_second': len(files) / seconds}}
+    for mask_type in mask_types:
+        seconds = best_time(lambda: [parse_page_xml(file, mask_type) for file in files], repeat)
+        reference = best_time(lambda: [reference_parse(file, mask_type) for file in files], repeat)
+        results[mask_type.value] = {'seconds': seconds, 'pages_per_second': len(files) / seconds,
+                                    'reference_seconds': reference, 'speedup': reference / seconds}
+    return results
+
+
+def bench_rasterize(pages, mask_types, scales, rasterizers, repeat):
+    results = {}
+    for backend in rasterizers:
+        generator = MaskGenerator(MaskSetting(RASTERIZER=backend), mask_types=mask_types)
+        for mask_type in mask_types:
+            for scale in scales:
+                seconds = best_time(lambda: [generator.render(page, mask_type, scale) for page in pages], repeat)
+                results['{}/{}/{:g}'.format(backend.value, mask_type.value, scale)] = {
+                    'seconds': seconds, 'ms_per_mask': 1000 * seconds / len(pages)}
+    return results
+
+
+def bench_simplify(pages, mask_types, scales, tolerances, rasterizers, repeat):
+    """
+    Rendering with simplified polygons compared to rendering without: time, speedup and differing pixels.
+    """
+    results = {}
+    for backend, mask_type in ((backend, mask_type) for backend in rasterizers for mask_type in mask_types):
+        setting = MaskSetting(MASK_TYPE=mask_type, LABEL_MAP=True, RASTERIZER=backend)
+        for scale in scales:
+            masks = [np.array(page_region_to_mask(page, setting, scale)) for page in pages]
+            base = best_time(lambda: [page_region_to_mask(page, setting, scale) for page in pages], repeat)
+            for tolerance in tolerances:
+                simplified = replace(setting, SIMPLIFY=True, SIMPLIFY_TOLERANCE=tolerance)
+                seconds = best_time(lambda: [page_region_to_mask(page, simplified, scale) for page in pages],
+                                    repeat)
+                differing = sum(int((np.array(page_region_to_mask(page, simplified, scale)) != mask).sum())
+                                for page, mask in zip(pages, masks))
+                results['{}/{}/{:g}/{:g}'.format(backend.value, mask_type.value, scale, tolerance)] = {
+                    'seconds': seconds, 'unsimplified_seconds': base, 'speedup': base / seconds,
+                    'differing_pixels': differing,
+                    'differing_fraction': differing / sum(mask.size for mask in masks)}
+    return results
+
+
+def bench_encode(pages, mask_types, extensions, repeat):
+    generator = MaskGenerator(MaskSetting(), mask_types=mask_types)
+    masks = [mask for page in pages for _, _, mask in generator.render_all(page)]
+    results = {}
+    for extension in extensions:
+        sizes = []
+
+        def encode():
+            sizes.clear()
+            for mask in masks:
+                buffer = io.BytesIO()
+                mask.save(buffer, format=extension)
+                sizes.append(buffer.tell())
+
+        seconds = best_time(encode, repeat)
+        results[extension] = {'seconds': seconds, 'ms_per_mask': 1000 * seconds / len(masks),
+                              'bytes_per_mask': float(np.mean(sizes))}
+    return results
+
+
+def bench_cli(input_dir, work_dir, num_files, processes, settings, chunksize, repeat):
+    results = {}
+    for count in processes:
+        output_dir = os.path.join(work_dir, 'out_{}'.format(count))
+        os.makedirs(output_dir, exist_ok=True)
+        command = [sys.executable, '-m', 'pagexml_mask_converter.pagexml_to_mask', '--input_dir', input_dir,
+                   '--output_dir', output_dir + os.sep, '--processes', str(count), '--chunksize', str(chunksize),
+                   '--no_progress', '--setting', *settings]
+        seconds = best_time(lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL,
+                                                   stderr=subprocess.DEVNULL), repeat)
+        results[str(count)] = {'seconds': seconds, 'files_per_second': num_files / seconds}
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'pillow': PIL.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def _flatten(results, prefix=''):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, prefix + key + '/')
+        elif key == 'seconds':
+            yield prefix.rstrip('/'), value
+
+
+def compare(results, baseline):
+    """
+    Prints the time of every benchmark relative to the baseline results, > 1 is slower.
+    """
+    old = dict(_flatten(baseline['benchmarks']))
+    for name, seconds in _flatten(results['benchmarks']):
+        if name in old and old[name] > 0:
+            print('{:<40} {:8.3f}s {:6.2f}x'.format(name, seconds, seconds / old[name]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=24, help="Number of synthetic pages")
+    parser.add_argument('--width', type=int, default=2480)
+    parser.add_argument('--height', type=int, default=3508)
+    parser.add_argument('--regions', type=int, default=20, help="Regions per page")
+    parser.add_argument('--lines', type=int, default=10, help="TextLines per TextRegion")
+    parser.add_argument('--vertices', type=int, default=16, help="Vertices per polygon")
+    parser.add_argument('--no_words', action='store_true',
+                        help="TextLines without Words, Glyphs and TextEquivs (word level pages by default)")
+    parser.add_argument('--setting', default=[mask_type.value for mask_type in MaskType], nargs='+',
+                        choices=[mask_type.value for mask_type in MaskType])
+    parser.add_argument('--scale', type=float, default=[1.0, 0.5], nargs='+')
+    parser.add_argument('--rasterizer', default=[backend.value for backend in RasterizerBackend], nargs='+',
+                        choices=[backend.value for backend in RasterizerBackend])
+    parser.add_argument('--extension', default=['png'], nargs='+', help="Image formats to encode")
+    parser.add_argument('--simplify_tolerance', type=float, default=[0.0, 0.5, 1.0], nargs='+',
+                        help="Tolerances in pixels of the simplify benchmark")
+    parser.add_argument('--processes', type=int, default=[1, 2, 4], nargs='+',
+                        help="Process counts of the command line runs")
+    parser.add_argument('--chunksize', type=int, default=1, help="Files per task of the command line runs")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', default=['parse', 'rasterize', 'simplify', 'encode', 'cli'], nargs='+',
+                        choices=['parse', 'rasterize', 'simplify', 'encode', 'cli'])
+    parser.add_argument('--output', type=str, default=None, help="Json file for the results")
+    parser.add_argument('--compare', type=str, default=None, help="Results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    config = SyntheticPageConfig(width=args.width, height=args.height, regions=args.regions, lines=args.lines,
+                                 vertices=args.vertices, words=not args.no_words)
+    mask_types = [MaskType(setting) for setting in args.setting]
+    benchmarks = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        input_dir = os.path.join(work_dir, 'xml')
+        files = write_corpus(input_dir, args.pages, config)
+        pages = [parse_page_xml(file, list(MaskType)) for file in files]
+        if 'parse' in args.stages:
+            benchmarks['parse'] = bench_parse(files, mask_types, args.repeat)
+        if 'rasterize' in args.stages:
+            benchmarks['rasterize'] = bench_rasterize(pages, mask_types, args.scale,
+                                                      [RasterizerBackend(r) for r in args.rasterizer], args.repeat)
+        if 'simplify' in args.stages:
+            benchmarks['simplify'] = bench_simplify(pages, mask_types, args.scale, args.simplify_tolerance,
+                                                    [RasterizerBackend(r) for r in args.rasterizer], args.repeat)
+        if 'encode' in args.stages:
+            benchmarks['encode'] = bench_encode(pages, mask_types, args.extension, args.repeat)
+        if 'cli' in args.stages:
+            benchmarks['cli'] = bench_cli(input_dir, work_dir, len(files), args.processes, args.setting,
+                                          args.chunksize, args.repeat)
+
+    results = {'environment': environment(), 'config': {**vars(config), 'pages': args.pages},
+               'benchmarks': benchmarks}
+    text = json.dumps(results, indent=4)
+    print(text)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # not available on windows, eviction is then not serialized across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self):
+        requests = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / requests if requests else 0.0
+
+    def to_dict(self):
+        return {**asdict(self), 'hit_rate': self.hit_rate}
+
+
+class MaskCache:
+    """
+    Content addressed on-disk cache of rendered masks with an optional in-process LRU layer.
+
+    Keys are derived from the xml content, the mask settings, the color map and the scale, so a changed
+    file or setting never hits an old entry. Masks are stored as .npy files, written to a temporary
+    file and renamed, so several processes can share a cache directory. When the directory grows beyond
+    max_bytes the least recently used entries are removed (under a lock file if fcntl is available).
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 10 * 1024 ** 3, memory_items: int = 0,
+                 check_interval: int = 64):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.check_interval = check_interval
+        self.stats = CacheStats()
+        self._memory = OrderedDict()
+        self._writes_since_check = 0
+        os.makedirs(directory, exist_ok=True)
+        self._size = self._scan()[1]
+
+    @staticmethod
+    def key(xml_content: bytes, settings: dict, scale: float, color_map: dict = None, window=None) -> str:
+        h = hashlib.sha256(xml_content)
+        h.update(json.dumps({'settings': settings, 'scale': scale, 'color_map': color_map,
+                             'window': list(window) if window is not None else None},
+                            sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.npy')
+
+    def _remember(self, key, mask):
+        if self.memory_items <= 0:
+            return
+        self._memory[key] = mask
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        mask = self._memory.get(key)
+        if mask is not None:
+            self._memory.move_to_end(key)
+            self.stats.memory_hits += 1
+            return mask.copy()
+        path = self._path(key)
+        try:
+            mask = np.load(path)
+        except (FileNotFoundError, ValueError, EOFError):
+            self.stats.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.stats.disk_hits += 1
+        self._remember(key, mask.copy())
+        return mask
+
+    def put(self, key, mask: np.ndarray):
+        self._remember(key, mask.copy())
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, mask)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.stats.writes += 1
+        self._size += os.path.getsize(path)
+        self._writes_since_check += 1
+        if self._size > self.max_bytes or self._writes_since_check >= self.check_interval:
+            self.evict()
+
+    def _scan(self):
+        entries = []
+        size = 0
+        for sub_dir in os.scandir(self.directory):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if not entry.name.endswith('.npy'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                size += stat.st_size
+        return entries, size
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is below 90% of max_bytes.
+        """
+        self._writes_since_check = 0
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            entries, size = self._scan()
+            if size > self.max_bytes:
+                for _, entry_size, path in sorted(entries):
+                    if size <= 0.9 * self.max_bytes:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        continue
+                    size -= entry_size
+                    self.stats.evictions += 1
+            self._size = size
+
+    def clear_memory(self):
+        self._memory.clear()
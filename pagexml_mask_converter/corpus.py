@@ -0,0 +1,186 @@
+import json
+import logging
+import multiprocessing
+import os
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from pagexml_mask_converter.pagexml_to_mask import CompactPageRegions, MaskType, parse_page_xml
+
+logger = logging.getLogger(__name__)
+
+CORPUS_VERSION = 1
+
+# name, dtype and number of columns of the arrays of a compiled corpus
+_ARRAYS = [
+    ('coords', np.int32, 2),
+    ('offsets', np.int64, 0),
+    ('region_codes', np.uint8, 0),
+    ('type_codes', np.int16, 0),
+    ('kind_codes', np.uint8, 0),
+    ('page_offsets', np.int64, 0),
+    ('image_sizes', np.int64, 2),
+]
+
+_HEADER_SIZE = 128
+
+
+class _NpyWriter:
+    """
+    Appends rows to a .npy file, whose header is written when the number of rows is known.
+    """
+
+    def __init__(self, path: str, dtype, columns: int = 0):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.columns = columns
+        self.rows = 0
+        self.file = open(path, 'wb')
+        self.file.write(b'\0' * _HEADER_SIZE)
+
+    def append(self, array: np.ndarray):
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        self.rows += len(array)
+        self.file.write(array.tobytes())
+
+    def close(self):
+        shape = (self.rows, self.columns) if self.columns else (self.rows,)
+        header = repr({'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False,
+                       'shape': shape}).encode('latin1')
+        prefix = b'\x93NUMPY\x01\x00'
+        length = _HEADER_SIZE - len(prefix) - 2
+        header = header.ljust(length - 1) + b'\n'
+        if len(header) != length:
+            raise ValueError("Shape {} does not fit into the .npy header".format(shape))
+        self.file.seek(0)
+        self.file.write(prefix + np.uint16(length).astype('<u2').tobytes() + header)
+        self.file.close()
+
+
+def _parse(file):
+    try:
+        # every kind of polygon, so that the corpus can be rendered as any mask type
+        return file, parse_page_xml(file, list(MaskType)), None
+    except Exception as e:
+        return file, None, '{}: {}'.format(type(e).__name__, e)
+
+
+def compile_corpus(files: Iterable[str], directory: str, processes: int = 4, chunksize: int = 8) -> int:
+    """
+    Parses files once and stores their pages in directory as a CompiledCorpus.
+
+    The points, offsets and codes of all pages are concatenated into one .npy file each, type codes refer
+    to a vocabulary shared by all pages. Files are parsed on processes worker processes (<= 1 parses in this
+    process) and written in the order of files as they arrive, so memory does not grow with the corpus.
+    Files that cannot be parsed are logged and left out. Returns the number of pages.
+    """
+    os.makedirs(directory, exist_ok=True)
+    writers = {name: _NpyWriter(os.path.join(directory, name + '.npy'), dtype, columns)
+               for name, dtype, columns in _ARRAYS}
+    r_types: Dict[str, int] = {}
+    sources, filenames = [], []
+    num_points, num_polygons = 0, 0
+    writers['offsets'].append([0])
+    writers['page_offsets'].append([0])
+
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        results = pool.imap(_parse, files, chunksize=chunksize) if pool is not None else map(_parse, files)
+        for source, page, error in results:
+            if error is not None:
+                logger.error("Failed to parse {}: {}".format(source, error))
+                continue
+            vocabulary = np.array([r_types.setdefault(r_type, len(r_types)) for r_type in page.r_types] + [-1],
+                                  dtype=np.int16)
+            writers['coords'].append(page.coords)
+            writers['offsets'].append(page.offsets[1:] + num_points)
+            writers['region_codes'].append(page.region_codes)
+            # a type code of -1 picks the -1 at the end of the vocabulary
+            writers['type_codes'].append(vocabulary[page.type_codes])
+            writers['kind_codes'].append(page.kind_codes)
+            num_points += len(page.coords)
+            num_polygons += page.num_polygons
+            writers['page_offsets'].append([num_polygons])
+            writers['image_sizes'].append([page.image_size])
+            sources.append(source)
+            filenames.append(page.filename)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        for writer in writers.values():
+            writer.close()
+
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'version': CORPUS_VERSION, 'r_types': list(r_types), 'sources': sources,
+                   'filenames': filenames}, f)
+    return len(sources)
+
+
+class CompiledCorpus:
+    """
+    Pages compiled by compile_corpus. The arrays are memory mapped, pages are read on demand by index::
+
+        corpus = CompiledCorpus('corpus_dir')
+        mask = mask_generator.render(corpus[0], MaskType.BASE_LINE)
+
+    Instances can be sent to worker processes, which map the files again.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != CORPUS_VERSION:
+            raise ValueError("Unsupported corpus version {} in {}".format(meta.get('version'), directory))
+        self.r_types = tuple(meta['r_types'])
+        self.sources: List[str] = meta['sources']
+        self.filenames: List[str] = meta['filenames']
+        self._arrays = None
+        self._index = None
+
+    @property
+    def arrays(self) -> Dict[str, np.ndarray]:
+        if self._arrays is None:
+            self._arrays = {name: np.load(os.path.join(self.directory, name + '.npy'), mmap_mode='r')
+                            for name, _, _ in _ARRAYS}
+        return self._arrays
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __getitem__(self, index: int) -> CompactPageRegions:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        arrays = self.arrays
+        first, last = (int(i) for i in arrays['page_offsets'][index:index + 2])
+        offsets = np.array(arrays['offsets'][first:last + 1])
+        coords = np.array(arrays['coords'][offsets[0]:offsets[-1]])
+        height, width = (int(i) for i in arrays['image_sizes'][index])
+        return CompactPageRegions(image_size=(height, width), filename=self.filenames[index], coords=coords,
+                                  offsets=offsets - offsets[0],
+                                  region_codes=np.array(arrays['region_codes'][first:last]),
+                                  type_codes=np.array(arrays['type_codes'][first:last]),
+                                  r_types=self.r_types,
+                                  kind_codes=np.array(arrays['kind_codes'][first:last]))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def index_of(self, source: str) -> int:
+        """
+        Index of the page compiled from the file source.
+        """
+        if self._index is None:
+            self._index = {source: index for index, source in enumerate(self.sources)}
+        return self._index[source]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        state['_index'] = None
+        return state
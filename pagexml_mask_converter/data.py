@@ -1,6 +1,8 @@
 import abc
 import enum
+import json
 from abc import ABC
+from collections import Counter
 
 import logging
 
@@ -118,6 +120,10 @@ class PageXMLRegionType(enum.Enum):
                 logger.warning("{} not known for region {}. Using default value of region".format(att_type, self.value))
             return self.region_color().color if color_text_non_text is False else self.region_color().text_non_text_color
 
+    @staticmethod
+    def get_class_palette(color_text_non_text=False):
+        return color_map_to_palette(PageXMLRegionType.to_dict(color_text_non_text=color_text_non_text))
+
     @staticmethod
     def to_dict(color_text_non_text=False, regions_only=False):
         color_dict = {}
@@ -143,6 +149,93 @@ class PageXMLRegionType(enum.Enum):
         return color_dict
 
 
+def color_map_to_palette(color_dict):
+    """
+    Turns a color map in the shape of PageXMLRegionType.to_dict into a list of colors indexed by class id.
+    Class 0 is the white background, the other colors follow in the order of the color map.
+    """
+    palette = [(255, 255, 255)]
+    for region in color_dict.values():
+        colors = [region['default_color']] + list(region['region_type_colors'].values())
+        for color in colors:
+            if color is not None and tuple(color) not in palette:
+                palette.append(tuple(color))
+    return palette
+
+
+class ColorTable:
+    """
+    Compiled (region, type) -> class id lookup for one color map.
+    Colors of the class ids are given by palette. Types that are not part of the color map fall back
+    to the class of their region and are counted in unknown_types instead of being logged each time.
+    """
+
+    def __init__(self, color_dict):
+        self.color_dict = color_dict
+        self.palette = color_map_to_palette(color_dict)
+        class_ids = {color: class_id for class_id, color in enumerate(self.palette)}
+
+        def class_of(color):
+            return class_ids[tuple(color)] if color is not None else None
+
+        self.region_classes = {}
+        self.type_classes = {}
+        for region, region_colors in color_dict.items():
+            self.region_classes[region] = class_of(region_colors['default_color'])
+            self.type_classes[(region, None)] = self.region_classes[region]
+            for r_type, color in region_colors['region_type_colors'].items():
+                self.type_classes[(region, r_type)] = class_of(color)
+        self.unknown_types = Counter()
+
+    @staticmethod
+    def from_page_xml_types(color_text_non_text=False):
+        return ColorTable(PageXMLRegionType.to_dict(color_text_non_text=color_text_non_text))
+
+    @staticmethod
+    def from_json(json_file):
+        """
+        Loads a color map in the shape of PageXMLRegionType.to_dict. A mask_setting.json
+        containing the color map under 'Color_Map' is accepted as well.
+        """
+        with open(json_file) as f:
+            color_dict = json.load(f)
+        return ColorTable(color_dict.get('Color_Map', color_dict))
+
+    def get_class(self, region, r_type=None, count=1):
+        try:
+            return self.type_classes[(region, r_type)]
+        except KeyError:
+            self.unknown_types[(region, r_type)] += count
+            return self.region_classes.get(region)
+
+    def get_color(self, region, r_type=None):
+        class_id = self.get_class(region, r_type)
+        return self.palette[class_id] if class_id is not None else None
+
+    def class_names(self):
+        """
+        Names of the (region, type) pairs of every class id as "region" or "region:type", the background is
+        class 0.
+        """
+        names = {0: ['background']}
+        for (region, r_type), class_id in self.type_classes.items():
+            if class_id is not None:
+                names.setdefault(class_id, []).append(region if r_type is None else '{}:{}'.format(region, r_type))
+        return names
+
+    def pop_unknown_types(self) -> Counter:
+        unknown_types = self.unknown_types
+        self.unknown_types = Counter()
+        return unknown_types
+
+
+def report_unknown_types(unknown_types: Counter):
+    if unknown_types:
+        logger.warning("Types not known for their region, using default value of region: {}".format(
+            ", ".join("{} in {} ({}x)".format(r_type, region, count)
+                      for (region, r_type), count in unknown_types.most_common())))
+
+
 class RegionAttributes(ABC):
     @abc.abstractmethod
     def get_color(self):
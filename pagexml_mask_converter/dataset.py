@@ -0,0 +1,120 @@
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, Future
+from functools import partial
+from typing import List
+
+import numpy as np
+
+from pagexml_mask_converter.pagexml_to_mask import MaskGenerator
+
+_worker_generator: MaskGenerator = None
+
+
+def _init_worker(mask_generator: MaskGenerator):
+    global _worker_generator
+    _worker_generator = mask_generator
+
+
+def _get_mask(file, scale):
+    return _worker_generator.get_mask(file, scale=scale)
+
+
+def _get_indexed_mask(task):
+    index, file, scale = task
+    return index, _worker_generator.get_mask(file, scale=scale)
+
+
+def get_masks(mask_generator: MaskGenerator, files, scale: float = 1.0, workers: int = 4, ordered: bool = True,
+              chunksize: int = 1):
+    """
+    Renders the masks of files on a pool of worker processes.
+    With ordered the masks are yielded in the order of files, otherwise (index in files, mask)
+    tuples are yielded as soon as they are finished. workers <= 1 renders in this process.
+    """
+    if workers <= 1:
+        for index, file in enumerate(files):
+            mask = mask_generator.get_mask(file, scale=scale)
+            yield mask if ordered else (index, mask)
+        return
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(mask_generator,)) as pool:
+        if ordered:
+            yield from pool.imap(partial(_get_mask, scale=scale), files, chunksize=chunksize)
+        else:
+            yield from pool.imap_unordered(_get_indexed_mask, ((i, f, scale) for i, f in enumerate(files)),
+                                           chunksize=chunksize)
+
+
+class MaskDataset:
+    """
+    Framework agnostic dataset of masks. Indexing renders the mask of the requested file and schedules
+    the next prefetch items on a pool of worker processes, so sequential access (also through iteration)
+    rarely waits for parsing and rendering. At most prefetch masks are held in memory.
+
+    Can be used as a map style dataset (e.g. with torch.utils.data.DataLoader), but needs no framework.
+    """
+
+    def __init__(self, files: List[str], mask_generator: MaskGenerator, scale: float = 1.0, prefetch: int = 8,
+                 workers: int = 2):
+        self.files = list(files)
+        self.mask_generator = mask_generator
+        self.scale = scale
+        self.prefetch = prefetch
+        self.workers = workers
+        self._executor = None
+        self._pending: 'OrderedDict[int, Future]' = OrderedDict()
+
+    def __len__(self):
+        return len(self.files)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                                 initargs=(self.mask_generator,))
+        return self._executor
+
+    def _schedule(self, index):
+        end = min(index + self.prefetch, len(self.files))
+        for i in list(self._pending):
+            if not index <= i < end:
+                self._pending.pop(i).cancel()
+        for i in range(index, end):
+            if i not in self._pending:
+                self._pending[i] = self._get_executor().submit(_get_mask, self.files[i], self.scale)
+
+    def __getitem__(self, index) -> np.ndarray:
+        if index < 0:
+            index += len(self.files)
+        if not 0 <= index < len(self.files):
+            raise IndexError(index)
+        if self.prefetch <= 0 or self.workers <= 0:
+            return self.mask_generator.get_mask(self.files[index], scale=self.scale)
+        self._schedule(index)
+        mask = self._pending.pop(index).result()
+        self._schedule(index + 1)
+        return mask
+
+    def __iter__(self):
+        for index in range(len(self.files)):
+            yield self[index]
+
+    def close(self):
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __getstate__(self):
+        # worker processes of data loaders get a copy without the pool
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        state['_pending'] = OrderedDict()
+        return state
@@ -0,0 +1,73 @@
+import glob
+import hashlib
+import os
+import sys
+from typing import Iterable, Iterator, Tuple
+
+
+def iter_directory(directory: str, extensions: Tuple[str, ...] = ('.xml',), recursive: bool = False) -> Iterator[str]:
+    """
+    Yields the files in directory ending with one of extensions, without listing the whole tree first.
+    """
+    pending = [directory]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if recursive:
+                        pending.append(entry.path)
+                elif entry.name.lower().endswith(extensions):
+                    yield entry.path
+
+
+def iter_file_list(file_list: str) -> Iterator[str]:
+    """
+    Yields the paths of a text file with one path per line, - reads them from stdin.
+    Empty lines and lines starting with # are ignored.
+    """
+    stream = sys.stdin if file_list == '-' else open(file_list)
+    try:
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def iter_inputs(input_dir: str = None, file_list: str = None, recursive: bool = False,
+                extensions: Tuple[str, ...] = ('.xml',)) -> Iterator[str]:
+    """
+    Input files of a conversion: the paths of file_list, the files of input_dir if it is a directory,
+    otherwise the files matching input_dir as a glob pattern (** matches subdirectories).
+    """
+    if file_list is not None:
+        yield from iter_file_list(file_list)
+    if input_dir is None:
+        return
+    if os.path.isdir(input_dir):
+        yield from iter_directory(input_dir, extensions=extensions, recursive=recursive)
+    else:
+        yield from glob.iglob(input_dir, recursive=True)
+
+
+def shard_of(key: str, num_shards: int) -> int:
+    """
+    Shard of a path. Depends only on the path, so every node computes the same split.
+    """
+    digest = hashlib.blake2b(key.encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % num_shards
+
+
+def select_shard(files: Iterable[str], shard_index: int, num_shards: int, root: str = None) -> Iterator[str]:
+    """
+    Yields the files of shard shard_index out of num_shards. With root, paths are hashed relative to it,
+    so nodes mounting the corpus at different places still agree on the split.
+    """
+    if not 0 <= shard_index < num_shards:
+        raise ValueError("Shard index {} is not in [0, {})".format(shard_index, num_shards))
+    for file in files:
+        key = os.path.relpath(file, root) if root is not None else file
+        if num_shards == 1 or shard_of(key.replace(os.sep, '/'), num_shards) == shard_index:
+            yield file
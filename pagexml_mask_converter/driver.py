@@ -0,0 +1,317 @@
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from collections import Counter
+from contextlib import nullcontext
+from itertools import chain
+from typing import Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from pagexml_mask_converter.corpus import CompiledCorpus
+from pagexml_mask_converter.manifest import Manifest
+from pagexml_mask_converter.packed import PackedMaskWriter
+from pagexml_mask_converter.rle import RLEMaskWriter
+from pagexml_mask_converter.stats import ClassCounts, RunStats, SampledProfiler
+from pagexml_mask_converter.writer import AsyncMaskWriter, EncoderOptions, MaskWriter
+from pagexml_mask_converter.pagexml_to_mask import MaskGenerator
+
+logger = logging.getLogger(__name__)
+
+_worker_generator: MaskGenerator = None
+_worker_output_dir: str = None
+_worker_corpus: CompiledCorpus = None
+_worker_packer: Union[PackedMaskWriter, RLEMaskWriter] = None
+_worker_writer: MaskWriter = None
+_worker_profiler: SampledProfiler = None
+
+# writers of the output formats that append masks to shard files
+_PACKERS = {'packed': PackedMaskWriter, 'rle': RLEMaskWriter}
+
+
+def _init_worker(mask_generator: MaskGenerator, output_dir: str, corpus: CompiledCorpus = None,
+                 shard_size: int = None, encoder_options: EncoderOptions = None, writer_threads: int = 0,
+                 max_pending: int = 8, output_format: str = 'image', profiler: SampledProfiler = None):
+    global _worker_generator, _worker_output_dir, _worker_corpus, _worker_packer, _worker_writer, _worker_profiler
+    _worker_generator = mask_generator
+    _worker_profiler = profiler
+    _worker_output_dir = output_dir
+    _worker_corpus = corpus
+    # every process appends to shards of its own
+    if output_format == 'image':
+        _worker_packer = None
+    elif output_format in _PACKERS:
+        packer = _PACKERS[output_format]
+        _worker_packer = packer(output_dir) if shard_size is None else packer(output_dir, shard_size)
+    else:
+        raise ValueError("Unknown output format {}".format(output_format))
+    writer_stats = RunStats() if mask_generator.stats is not None else None
+    if writer_threads > 0:
+        _worker_writer = AsyncMaskWriter(encoder_options, threads=writer_threads, max_pending=max_pending,
+                                         stats=writer_stats)
+    else:
+        _worker_writer = MaskWriter(encoder_options, stats=writer_stats)
+
+
+def _close_worker():
+    for output in (_worker_packer, _worker_writer):
+        if output is not None:
+            output.close()
+
+
+class FileResult(NamedTuple):
+    file: str
+    unknown_types: Counter
+    seconds: float
+    error: Optional[str] = None
+    details: Optional[str] = None
+    outputs: Tuple[str, ...] = ()
+    # stats and class counts of the whole batch of the file, sent with its last file, if the generator
+    # collects them
+    stats: Optional[RunStats] = None
+    class_counts: Optional[ClassCounts] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _error_result(file, start, e) -> FileResult:
+    return FileResult(file, Counter(), time.perf_counter() - start, error='{}: {}'.format(type(e).__name__, e),
+                      details=''.join(traceback.format_exception(type(e), e, e.__traceback__)))
+
+
+def _save_batch(files) -> List[FileResult]:
+    """
+    Converts a batch of files, or with a compiled corpus the pages with the indices files.
+    The masks of the whole batch are handed to the writer, which may encode and write them while the next
+    files are rendered. A file's result is complete once its writes are done.
+    """
+    batch_start = time.perf_counter()
+    results = []
+    for file in files:
+        start = time.perf_counter()
+        if _worker_corpus is not None:
+            index, file = file, _worker_corpus.sources[file]
+        try:
+            with _worker_profiler.sample(file) if _worker_profiler is not None else nullcontext():
+                if _worker_corpus is not None:
+                    outputs, unknown_types = _worker_generator.write_page(
+                        _worker_corpus[index], _worker_output_dir, packer=_worker_packer, writer=_worker_writer)
+                else:
+                    outputs, unknown_types = _worker_generator.write(file, _worker_output_dir,
+                                                                     packer=_worker_packer, writer=_worker_writer)
+        except Exception as e:
+            # a broken file must not end the run, the error is reported with the file instead
+            _worker_writer.pop_submitted()
+            results.append((_error_result(file, start, e), start, []))
+            continue
+        results.append((FileResult(file, unknown_types, 0.0, outputs=tuple(outputs)), start,
+                        _worker_writer.pop_submitted()))
+
+    finished = []
+    for result, start, writes in results:
+        try:
+            for write in writes:
+                write.result()
+        except Exception as e:
+            result = _error_result(result.file, start, e)
+        finished.append(result._replace(seconds=time.perf_counter() - start) if result.ok else result)
+
+    stats = _worker_generator.pop_stats()
+    if stats is not None and finished:
+        stats.merge(_worker_writer.pop_stats())
+        stats.worker(time.perf_counter() - batch_start, files=len(finished))
+        finished[-1] = finished[-1]._replace(stats=stats)
+    class_counts = _worker_generator.pop_class_counts()
+    if class_counts is not None and finished:
+        finished[-1] = finished[-1]._replace(class_counts=class_counts)
+    return finished
+
+
+def _batches(files: Iterable, size: int):
+    batch = []
+    for file in files:
+        batch.append(file)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Progress:
+    """
+    Prints the number of processed files and the throughput to a stream, at most every interval seconds.
+    """
+
+    def __init__(self, total: Optional[int] = None, interval: float = 0.5, stream=None):
+        self.total = total
+        self.interval = interval
+        self.stream = stream if stream is not None else sys.stderr
+        self.done = 0
+        self.failed = 0
+        self.start = time.perf_counter()
+        self._last = 0.0
+
+    def update(self, result: FileResult):
+        self.done += 1
+        self.failed += not result.ok
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            self._write('\r')
+
+    def clear(self):
+        """
+        Removes the progress line, so that log messages start on an empty line.
+        """
+        if self.done:
+            self.stream.write('\r\033[K')
+            self.stream.flush()
+
+    def finish(self):
+        self._write('\r')
+        self.stream.write('\n')
+        self.stream.flush()
+
+    def _write(self, prefix):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        total = '/{}'.format(self.total) if self.total is not None else ''
+        self.stream.write('{}{}{} files, {} failed, {:.1f} files/s, {:.1f}s'.format(
+            prefix, self.done, total, self.failed, self.done / elapsed, elapsed))
+        self.stream.flush()
+
+
+class RunReport(NamedTuple):
+    processed: int
+    failures: List[FileResult]
+    unknown_types: Counter
+    seconds: float
+    skipped: int = 0
+    stats: Optional[RunStats] = None
+    class_counts: Optional[ClassCounts] = None
+
+    def to_dict(self):
+        return {
+            'processed': self.processed,
+            'skipped': self.skipped,
+            'failed': len(self.failures),
+            'seconds': self.seconds,
+            'errors': [{'file': r.file, 'error': r.error, 'details': r.details} for r in self.failures],
+        }
+
+    def write_errors(self, path: str):
+        with open(path, 'w') as file_to_write:
+            json.dump(self.to_dict(), file_to_write, indent=4)
+
+
+def iter_results(mask_generator: MaskGenerator, files: Iterable, output_dir: str, processes: int = 4,
+                 chunksize: int = 8, corpus: CompiledCorpus = None, shard_size: int = None,
+                 encoder_options: EncoderOptions = None, writer_threads: int = 0,
+                 max_pending: int = 8, output_format: str = 'image',
+                 profiler: SampledProfiler = None) -> Iterable[FileResult]:
+    """
+    Saves the masks of files to output_dir and yields a FileResult per file as soon as it is finished,
+    in completion order. files may be any iterable, it is consumed lazily, chunksize files at a time.
+    With a compiled corpus, files are indices of its pages. output_format 'packed' packs the mask arrays into
+    shards (see pagexml_mask_converter.packed), 'rle' appends the COCO RLE of the label maps to shards
+    (see pagexml_mask_converter.rle) instead of writing images, shard_size limits the bytes of a shard.
+    With writer_threads, every process encodes and writes its images on that many threads while it renders,
+    holding at most max_pending masks (see pagexml_mask_converter.writer.AsyncMaskWriter).
+    With a profiler, every process profiles a sample of its pages.
+    processes <= 1 renders in this process without a pool.
+    """
+    init_args = (mask_generator, output_dir, corpus, shard_size, encoder_options, writer_threads, max_pending,
+                 output_format, profiler)
+    if processes <= 1:
+        _init_worker(*init_args)
+        try:
+            for batch in _batches(files, chunksize):
+                yield from _save_batch(batch)
+        finally:
+            _close_worker()
+        return
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=init_args) as pool:
+        for results in pool.imap_unordered(_save_batch, _batches(files, chunksize)):
+            yield from results
+
+
+def _unique_outputs(files: Iterable, corpus: CompiledCorpus, duplicates: List[FileResult]) -> Iterable:
+    """
+    Passes on the files whose masks are named differently from the ones of every earlier file. The others,
+    e.g. b/0001.xml after a/0001.xml of a recursive run, would overwrite those masks and are appended to
+    duplicates as failed results instead.
+    """
+    first_files = {}
+    for file in files:
+        source = corpus.sources[file] if corpus is not None else file
+        name = corpus.filenames[file] if corpus is not None else os.path.splitext(os.path.basename(file))[0]
+        first = first_files.setdefault(name, source)
+        if first == source:
+            yield file
+        else:
+            duplicates.append(FileResult(source, Counter(), 0.0, error="Duplicate output name: {} is written "
+                                                                         "for {} already".format(name, first)))
+
+
+def run(mask_generator: MaskGenerator, files: Iterable, output_dir: str, processes: int = 4,
+        chunksize: int = 8, progress: bool = True, manifest: Manifest = None,
+        corpus: CompiledCorpus = None, shard_size: int = None, encoder_options: EncoderOptions = None,
+        writer_threads: int = 0, max_pending: int = 8, output_format: str = 'image',
+        profiler: SampledProfiler = None) -> RunReport:
+    """
+    Saves the masks of all files, collecting failures and unknown region types instead of stopping at the
+    first broken file. Files whose masks would overwrite the masks of an earlier file with the same name
+    are not converted but reported as failures.
+    With a manifest, files that are up to date are skipped and converted files are recorded in it.
+    With a compiled corpus, files are indices of its pages, which are rendered without parsing XML.
+    output_format 'packed' or 'rle' appends the masks to shard files instead of writing images, with
+    writer_threads images are encoded and written while rendering goes on, see iter_results.
+    If the generator collects stats or counts classes, the stats and class counts of all workers are merged
+    into the report.
+    """
+    total = len(files) if hasattr(files, '__len__') and manifest is None else None
+    duplicates = []
+    files = _unique_outputs(files, corpus, duplicates)
+    if manifest is not None:
+        files = manifest.stale(files)
+    progress = Progress(total) if progress else None
+    start = time.perf_counter()
+    processed = 0
+    failures = []
+    unknown_types = Counter()
+    stats = RunStats() if mask_generator.stats is not None else None
+    class_counts = ClassCounts() if mask_generator.class_counts is not None else None
+    results = iter_results(mask_generator, files, output_dir, processes=processes, chunksize=chunksize,
+                           corpus=corpus, shard_size=shard_size, encoder_options=encoder_options,
+                           writer_threads=writer_threads, max_pending=max_pending, output_format=output_format,
+                           profiler=profiler)
+    # files with the output name of an earlier file are found while the files are read, they fail at the end
+    for result in chain(results, duplicates):
+        processed += 1
+        if stats is not None and result.stats is not None:
+            stats.merge(result.stats)
+        if class_counts is not None and result.class_counts is not None:
+            class_counts.merge(result.class_counts)
+        if result.ok:
+            unknown_types.update(result.unknown_types)
+            if manifest is not None:
+                manifest.record(result.file, result.outputs)
+        else:
+            if progress is not None:
+                progress.clear()
+            logger.error("Failed to convert {}: {}".format(result.file, result.error))
+            failures.append(result)
+        if progress is not None:
+            progress.update(result)
+    if progress is not None:
+        progress.finish()
+    if stats is not None:
+        stats.unknown_types.update(unknown_types)
+        stats.count(failed=len(failures))
+    return RunReport(processed, failures, unknown_types, time.perf_counter() - start,
+                     skipped=manifest.skipped if manifest is not None else 0, stats=stats,
+                     class_counts=class_counts)
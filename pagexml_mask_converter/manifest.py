@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+
+def file_signature(file: str, use_hash: bool = False) -> Dict:
+    """
+    Size and modification time of file, with use_hash also the sha256 of its content.
+    """
+    stat = os.stat(file)
+    signature = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if use_hash:
+        sha = hashlib.sha256()
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        signature['sha256'] = sha.hexdigest()
+    return signature
+
+
+def output_exists(output: str) -> bool:
+    """
+    Whether an output exists: a mask file, or the shard of a mask appended to a shard ("<shard path>#<name>",
+    see PackedMaskWriter.add).
+    """
+    if os.path.exists(output):
+        return True
+    directory, name = os.path.split(output)
+    shard, separator, _ = name.partition('#')
+    return bool(separator) and os.path.exists(os.path.join(directory, shard))
+
+
+class Manifest:
+    """
+    Record of the converted files of an output directory, which makes conversions incremental.
+
+    The manifest is a json lines file. The first line holds the settings the masks were rendered with,
+    every further line an input file with its signature (size, mtime and optionally a content hash) and
+    the written masks, masks appended to shards as "<shard path>#<name>". Entries are appended as soon as
+    a file is converted, so an interrupted run keeps everything it finished. A rerun skips files whose
+    signature is unchanged and whose masks all exist. If the settings differ from the recorded ones, all
+    files are stale.
+    """
+
+    def __init__(self, directory: str, settings: Dict, use_hash: bool = False, name: str = 'manifest.jsonl'):
+        """
+        :param settings: json serializable description of the rendering, e.g. MaskGenerator.to_dict()
+        :param use_hash: compare files by content hash. Files whose size or mtime changed are only rendered
+            again if their content changed as well.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, name)
+        # compare the settings as they are read back from json (tuples become lists, ...)
+        self.settings = json.loads(json.dumps(settings))
+        self.use_hash = use_hash
+        self.entries: Dict[str, Dict] = {}
+        self.settings_changed = False
+        self.skipped = 0
+        self._pending: Dict[str, Dict] = {}
+        # stale files are checked in the thread feeding the worker pool, results recorded in the main thread
+        self._lock = threading.Lock()
+        self._load()
+        self._file = open(self.path, 'a')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            self._rewrite()
+            return
+        with open(self.path) as f:
+            lines = iter(f)
+            try:
+                header = json.loads(next(lines))
+            except (StopIteration, ValueError):
+                header = {}
+            if header.get('settings') != self.settings:
+                logger.info("Settings changed since the last run, all files are converted again")
+                self.settings_changed = True
+            else:
+                for line in lines:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line of an interrupted run may be incomplete
+                        continue
+                    self.entries[entry['file']] = entry
+        if self.settings_changed:
+            self._rewrite()
+
+    def _rewrite(self):
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps({'settings': self.settings}) + '\n')
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _key(file: str) -> str:
+        return os.path.abspath(file)
+
+    def is_up_to_date(self, file: str) -> bool:
+        """
+        Checks file against its entry. The signature of a stale file is kept for record.
+        """
+        key = self._key(file)
+        entry = self.entries.get(key)
+        try:
+            signature = file_signature(file)
+        except OSError:
+            # let the conversion report the problem
+            return False
+        if entry is not None and all(output_exists(output) for output in entry['outputs']):
+            if entry['size'] == signature['size'] and entry['mtime_ns'] == signature['mtime_ns']:
+                return True
+            if self.use_hash and 'sha256' in entry:
+                signature = file_signature(file, use_hash=True)
+                if entry['sha256'] == signature['sha256']:
+                    # only touched, remember the new modification time
+                    self._append({**entry, **signature})
+                    return True
+        if self.use_hash and 'sha256' not in signature:
+            signature = file_signature(file, use_hash=True)
+        self._pending[key] = signature
+        return False
+
+    def stale(self, files: Iterable[str]) -> Iterable[str]:
+        """
+        Yields the files of files that need to be converted and counts the others in skipped.
+        """
+        for file in files:
+            if self.is_up_to_date(file):
+                self.skipped += 1
+            else:
+                yield file
+
+    def record(self, file: str, outputs: List[str]):
+        """
+        Records that file was converted to outputs, with the signature it had when it was checked.
+        """
+        key = self._key(file)
+        signature = self._pending.pop(key, None) or file_signature(file, use_hash=self.use_hash)
+        self._append({'file': key, **signature, 'outputs': [os.path.abspath(output) for output in outputs]})
+
+    def _append(self, entry: Dict):
+        with self._lock:
+            self.entries[entry['file']] = entry
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+
+    def prune(self) -> List[str]:
+        """
+        Deletes the masks of files that do not exist anymore and drops their entries.
+        Masks appended to shards are not deleted, as their shards hold the masks of other files as well.
+        Returns the deleted masks.
+        """
+        removed = []
+        for key in [key for key in self.entries if not os.path.exists(key)]:
+            for output in self.entries.pop(key)['outputs']:
+                if os.path.exists(output):
+                    os.remove(output)
+                    removed.append(output)
+        return removed
+
+    def close(self):
+        """
+        Compacts the manifest to a single line per file.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._rewrite()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,137 @@
+import glob
+import json
+import os
+import time
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+_ALIGNMENT = 64
+
+
+class PackedEntry(NamedTuple):
+    shard: str
+    offset: int
+    shape: Tuple[int, ...]
+    dtype: str
+    written: int
+
+    def to_dict(self):
+        return self._asdict()
+
+
+class PackedMaskWriter:
+    """
+    Appends masks to shard files of a directory instead of writing an image file per mask.
+
+    The raw bytes of every mask are appended (aligned to 64 bytes) to a shard file masks-<id>-<n>.bin,
+    a new shard is started when shard_size bytes are reached. Name, shard, offset, shape and dtype of every
+    mask go to the index file masks-<id>-<n>.index.jsonl next to the shard. Every process writes its own
+    shards, so worker processes can write in parallel without coordination. Entries are flushed with their
+    data, so the masks of an interrupted run stay readable.
+    """
+    # masks are stored as rendered with the settings of the mask generator
+    label_map = None
+
+    def __init__(self, directory: str, shard_size: int = 4 << 30, writer_id: str = None):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.writer_id = writer_id if writer_id is not None else '{}-{}'.format(os.getpid(), time.time_ns())
+        self._shard = -1
+        self._data = None
+        self._index = None
+        self._offset = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def shard_path(self) -> str:
+        return os.path.join(self.directory, 'masks-{}-{}.bin'.format(self.writer_id, self._shard))
+
+    def _next_shard(self):
+        self.close()
+        self._shard += 1
+        self._data = open(self.shard_path, 'wb')
+        self._index = open(os.path.splitext(self.shard_path)[0] + '.index.jsonl', 'w')
+        self._offset = 0
+
+    def add(self, name: str, mask) -> str:
+        """
+        Appends mask, an array or image, under name and returns "<shard path>#<name>", the mask in the shard
+        it was written to.
+        """
+        mask = np.ascontiguousarray(mask)
+        if self._data is None or (self._offset > 0 and self._offset + mask.nbytes > self.shard_size):
+            self._next_shard()
+        padding = -self._offset % _ALIGNMENT
+        self._data.write(b'\0' * padding + mask.tobytes())
+        self._data.flush()
+        entry = PackedEntry(shard=os.path.basename(self.shard_path), offset=self._offset + padding,
+                            shape=tuple(mask.shape), dtype=mask.dtype.str, written=time.time_ns())
+        self._offset += padding + mask.nbytes
+        self._index.write(json.dumps({'name': name, **entry.to_dict()}) + '\n')
+        self._index.flush()
+        return '{}#{}'.format(self.shard_path, name)
+
+    def close(self):
+        for f in (self._data, self._index):
+            if f is not None:
+                f.close()
+        self._data = self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class PackedMasks:
+    """
+    Reads the masks written by PackedMaskWriter. Shards are memory mapped and masks[name] returns a
+    read only view into the mapping, no data is copied or decoded.
+    If a name was written more than once, the last written mask is used.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.entries: Dict[str, PackedEntry] = {}
+        self._maps: Dict[str, np.memmap] = {}
+        for index_file in sorted(glob.glob(os.path.join(directory, 'masks-*.index.jsonl'))):
+            with open(index_file) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line of an interrupted run may be incomplete
+                        continue
+                    name = entry.pop('name')
+                    entry = PackedEntry(**{**entry, 'shape': tuple(entry['shape'])})
+                    if name not in self.entries or self.entries[name].written <= entry.written:
+                        self.entries[name] = entry
+
+    def names(self) -> List[str]:
+        return list(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def _map(self, shard: str) -> np.memmap:
+        if shard not in self._maps:
+            self._maps[shard] = np.memmap(os.path.join(self.directory, shard), dtype=np.uint8, mode='r')
+        return self._maps[shard]
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        entry = self.entries[name]
+        dtype = np.dtype(entry.dtype)
+        size = int(np.prod(entry.shape)) * dtype.itemsize
+        if size == 0:
+            return np.empty(entry.shape, dtype=dtype)
+        return self._map(entry.shard)[entry.offset:entry.offset + size].view(dtype).reshape(entry.shape)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_maps'] = {}
+        return state
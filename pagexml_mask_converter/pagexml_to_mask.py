@@ -1,16 +1,23 @@
 import enum
+import io
 import json
 import xml.etree.ElementTree as ET
-from typing import NamedTuple, List, Tuple
-from PIL import Image, ImageDraw
-import glob
-import multiprocessing
+from xml.parsers import expat
+from typing import Dict, NamedTuple, List, Tuple
+from PIL import Image
 import argparse
 import os
+import sys
+import time
 import numpy as np
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 
-from pagexml_mask_converter.data import PageXMLRegionType
+from collections import Counter
+
+from pagexml_mask_converter.data import PageXMLRegionType, ColorTable, report_unknown_types
+from pagexml_mask_converter.rasterizer import DrawList, RasterizerBackend
+from pagexml_mask_converter.simplify import simplify_polygons
+from pagexml_mask_converter.stats import ClassCounts, RunStats, timed
 import logging
 
 logger = logging.getLogger(__name__)
@@ -22,6 +29,23 @@ class MaskType(enum.Enum):
     BASE_LINE = 'baseline'
     TEXT_LINE = 'text_line'
 
+    def color_text_non_text(self):
+        return self in (MaskType.TEXT_NONTEXT, MaskType.BASE_LINE)
+
+    def polygon_kind(self) -> int:
+        return {
+            MaskType.ALLTYPES: KIND_REGION,
+            MaskType.TEXT_NONTEXT: KIND_REGION,
+            MaskType.BASE_LINE: KIND_BASELINE,
+            MaskType.TEXT_LINE: KIND_TEXT_LINE,
+        }[self]
+
+
+# Kinds of polygons collected from a page: region Coords, TextLine Coords and TextLine Baselines
+KIND_REGION = 0
+KIND_TEXT_LINE = 1
+KIND_BASELINE = 2
+
 
 class PCGTSVersion(enum.Enum):
     PCGTS2017 = '2017'
@@ -42,6 +66,13 @@ class PCGTSVersion(enum.Enum):
             PCGTSVersion.PCGTS2019S: 'https://schema.primaresearch.org/PAGE/gts/pagecontent/2019-07-15',
         }[self]
 
+    @staticmethod
+    def from_namespace(namespace: str):
+        for version in PCGTSVersion:
+            if version.get_namespace() == namespace:
+                return version
+        return None
+
 
 @dataclass
 class MaskSetting():
@@ -51,6 +82,13 @@ class MaskSetting():
     LINEWIDTH: int = 5
     BASELINELENGTH: int = 20
     SETTING_OUTPUT: bool = False
+    LABEL_MAP: bool = False
+    RASTERIZER: RasterizerBackend = RasterizerBackend.PIL
+    # remove duplicate and horizontally or vertically collinear vertices after scaling, with a tolerance > 0
+    # (in pixels of the mask) also all collinear vertices and the ones Douglas-Peucker finds closer to the
+    # simplified polygon
+    SIMPLIFY: bool = False
+    SIMPLIFY_TOLERANCE: float = 0.0
 
     def to_dict(self):
         json_dict = {}
@@ -85,6 +123,201 @@ class PageRegions(NamedTuple):
         return (np.array(self.image_size) * scale).astype(int)
 
 
+REGION_TYPES: List[str] = PageXMLRegionType.get_region_types()
+REGION_CODES = {region: code for code, region in enumerate(REGION_TYPES)}
+
+
+class CompactPageRegions(NamedTuple):
+    """
+    Array backed representation of a page.
+
+    All points of a page are stored in one (N, 2) int32 buffer. Polygon i spans
+    coords[offsets[i]:offsets[i + 1]]. Its region is REGION_TYPES[region_codes[i]] and its
+    type r_types[type_codes[i]] (a type code of -1 means the region has no type attribute).
+    kind_codes tells whether the polygon is a region, a text line or a baseline (KIND_*).
+    The attributes of PageRegions are available as well, so it can be used in its place.
+    """
+    image_size: Tuple[int, int]
+    filename: str
+    coords: np.ndarray
+    offsets: np.ndarray
+    region_codes: np.ndarray
+    type_codes: np.ndarray
+    r_types: Tuple[str, ...]
+    kind_codes: np.ndarray
+
+    @property
+    def num_polygons(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def xml_regions(self) -> List[RegionType]:
+        return [RegionType(polygon=polygon, region=REGION_TYPES[region_code],
+                           r_type=self.r_types[type_code] if type_code >= 0 else None)
+                for polygon, region_code, type_code in zip(self.polygons(), self.region_codes.tolist(),
+                                                           self.type_codes.tolist())]
+
+    def get_scaled_image_size(self, scale):
+        return (np.array(self.image_size) * scale).astype(int)
+
+    def get_scaled_coords(self, scale) -> np.ndarray:
+        return (self.coords * scale).astype(int)
+
+    def get_bounds(self, coords: np.ndarray = None) -> np.ndarray:
+        """
+        Bounding boxes (x_min, y_min, x_max, y_max) of all polygons as a (P, 4) array.
+        Polygons without points get an empty box (min > max).
+        """
+        coords = self.coords if coords is None else coords
+        bounds = np.empty((self.num_polygons, 4), dtype=np.int64)
+        bounds[:, :2] = np.iinfo(np.int32).max
+        bounds[:, 2:] = np.iinfo(np.int32).min
+        non_empty = np.diff(self.offsets) > 0
+        if non_empty.any():
+            starts = self.offsets[:-1][non_empty]
+            bounds[non_empty, :2] = np.minimum.reduceat(coords, starts, axis=0)
+            bounds[non_empty, 2:] = np.maximum.reduceat(coords, starts, axis=0)
+        return bounds
+
+    def polygons(self, coords: np.ndarray = None) -> List[np.ndarray]:
+        coords = self.coords if coords is None else coords
+        return np.split(coords, self.offsets[1:-1]) if self.num_polygons > 0 else []
+
+    def select(self, kind: int) -> 'CompactPageRegions':
+        """
+        Returns the page with only the polygons of the given kind.
+        """
+        return self.select_polygons(self.kind_codes == kind)
+
+    def select_polygons(self, selected: np.ndarray) -> 'CompactPageRegions':
+        """
+        Returns the page with only the polygons for which the boolean array selected is set.
+        """
+        if selected.all():
+            return self
+        counts = np.diff(self.offsets)
+        point_selected = np.repeat(selected, counts)
+        offsets = np.zeros(int(selected.sum()) + 1, dtype=np.int64)
+        np.cumsum(counts[selected], out=offsets[1:])
+        return self._replace(coords=self.coords[point_selected], offsets=offsets,
+                             region_codes=self.region_codes[selected], type_codes=self.type_codes[selected],
+                             kind_codes=self.kind_codes[selected])
+
+    def to_page_regions(self) -> PageRegions:
+        return PageRegions(image_size=self.image_size, xml_regions=self.xml_regions, filename=self.filename)
+
+    @staticmethod
+    def from_page_regions(page_regions: PageRegions, kind: int = KIND_REGION) -> 'CompactPageRegions':
+        """
+        Converts a PageRegions, whose polygons are all considered to be of the given kind.
+        """
+        if isinstance(page_regions, CompactPageRegions):
+            return page_regions
+        builder = _PageBuilder()
+        for region in page_regions.xml_regions:
+            builder.add_polygon(np.asarray(region.polygon, dtype=np.int32).reshape(-1, 2),
+                                region.region, region.r_type, kind)
+        return builder.build(page_regions.image_size, page_regions.filename)
+
+
+class _PageBuilder:
+    """
+    Collects the polygons of a page and turns them into a CompactPageRegions.
+    Points strings are kept as they are and parsed together when the page is built.
+    With problems, the ids of the elements of the polygons are kept as well, malformed points strings are
+    recorded in problems and left out of the page instead of failing it, see check.
+    """
+
+    def __init__(self, problems: List[Dict] = None):
+        self.points = []
+        self.region_codes = []
+        self.type_codes = []
+        self.kind_codes = []
+        self.r_types = {}
+        self.problems = problems
+        self.elements = [] if problems is not None else None
+        self.malformed = set()
+
+    def _add_codes(self, region, r_type, kind):
+        self.region_codes.append(REGION_CODES[region])
+        self.type_codes.append(-1 if r_type is None else self.r_types.setdefault(r_type, len(self.r_types)))
+        self.kind_codes.append(kind)
+
+    def add_points(self, points: str, region: str, r_type: str, kind: int, element: str = None):
+        self.points.append(points or '')
+        self._add_codes(region, r_type, kind)
+        if self.elements is not None:
+            self.elements.append(element)
+
+    def add_polygon(self, polygon: np.ndarray, region: str, r_type: str, kind: int):
+        self.points.append(polygon)
+        self._add_codes(region, r_type, kind)
+
+    def _drop_malformed_points(self):
+        for index, points in enumerate(self.points):
+            try:
+                string_to_array(points)
+            except ValueError:
+                self.problems.append(_problem('bad_points', "Malformed points attribute {!r}".format(points[:100]),
+                                              self.elements[index]))
+                self.points[index] = ''
+                self.malformed.add(index)
+
+    def build(self, image_size, filename) -> CompactPageRegions:
+        if all(isinstance(p, str) for p in self.points):
+            try:
+                coords, counts = points_to_array(self.points)
+            except ValueError:
+                if self.problems is None:
+                    raise
+                self._drop_malformed_points()
+                coords, counts = points_to_array(self.points)
+        else:
+            polygons = [string_to_array(p) if isinstance(p, str) else p for p in self.points]
+            counts = np.array([len(p) for p in polygons], dtype=np.int64)
+            coords = np.concatenate(polygons).astype(np.int32) if polygons else np.zeros((0, 2), dtype=np.int32)
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return CompactPageRegions(image_size=image_size, filename=filename, coords=coords.reshape(-1, 2),
+                                  offsets=offsets,
+                                  region_codes=np.array(self.region_codes, dtype=np.uint8),
+                                  type_codes=np.array(self.type_codes, dtype=np.int16),
+                                  r_types=tuple(self.r_types),
+                                  kind_codes=np.array(self.kind_codes, dtype=np.uint8))
+
+    def check(self, page: CompactPageRegions):
+        """
+        Records polygons of page with too few points (3 for Coords, 2 for a Baseline) and polygons with points
+        outside of the image in problems. Polygons with malformed points have been recorded already.
+        """
+        counts = np.diff(page.offsets)
+        too_few = counts < np.where(page.kind_codes == KIND_BASELINE, 2, 3)
+        for index in np.flatnonzero(too_few).tolist():
+            if index in self.malformed:
+                continue
+            self.problems.append(_problem('too_few_points', "{} {} points".format(
+                _KIND_ELEMENTS[page.kind_codes[index]], counts[index]), self.elements[index]))
+        height, width = page.image_size
+        outside = ((page.coords < 0) | (page.coords >= (width, height))).any(axis=1)
+        if outside.any():
+            owner = np.repeat(np.arange(len(counts)), counts)
+            for index, count in zip(*np.unique(owner[outside], return_counts=True)):
+                start, end = page.offsets[index], page.offsets[index + 1]
+                first = page.coords[start:end][outside[start:end]][0]
+                self.problems.append(_problem('out_of_bounds', "{} has {} of {} points outside of the {}x{} image, "
+                                              "e.g. {},{}".format(_KIND_ELEMENTS[page.kind_codes[index]], count,
+                                                                  counts[index], width, height, *first),
+                                              self.elements[index]))
+
+
+# names of the elements of the kinds of polygons, for problems
+_KIND_ELEMENTS = {KIND_REGION: 'Coords', KIND_TEXT_LINE: 'TextLine Coords', KIND_BASELINE: 'Baseline'}
+
+
+def _problem(problem: str, message: str, element: str = None) -> Dict:
+    return {'problem': problem, 'element': element, 'message': message}
+
+
 from abc import ABC, abstractmethod
 
 
@@ -95,84 +328,431 @@ class BaseMaskGenerator(ABC):
 
 
 class MaskGenerator(BaseMaskGenerator):
-    def __init__(self, settings: MaskSetting):
+    def __init__(self, settings: MaskSetting, color_map: str = None, mask_types: List[MaskType] = None,
+                 scales: List[float] = None, cache=None, collect_stats: bool = False,
+                 count_classes: bool = False):
+        """
+        :param color_map: optional json file with a color map in the shape of PageXMLRegionType.to_dict.
+            It replaces the default colors for every mask type.
+        :param mask_types: mask types rendered by save, defaults to settings.MASK_TYPE
+        :param scales: scales rendered by save, defaults to 1.0
+        :param cache: optional pagexml_mask_converter.cache.MaskCache used by get_mask
+        :param collect_stats: time the stages of a conversion and count what is processed in stats,
+            see pop_stats
+        :param count_classes: count the pixels of every class of the rendered pages in class_counts,
+            see pop_class_counts
+        """
         self.settings = settings
+        self.cache = cache
+        self.stats = RunStats() if collect_stats else None
+        self.class_counts = ClassCounts() if count_classes else None
+        self.logged_types = set()
         self.xml_namespace = self.settings.PCGTS_VERSION.get_namespace()
+        self.mask_types = mask_types if mask_types else [settings.MASK_TYPE]
+        self.scales = scales if scales else [1.0]
+        if color_map is not None:
+            table = ColorTable.from_json(color_map)
+            self.color_tables = {False: table, True: table}
+        else:
+            self.color_tables = {t_nt: ColorTable.from_page_xml_types(color_text_non_text=t_nt)
+                                 for t_nt in (False, True)}
 
-    def save(self, file, output_dir):
+    def get_color_table(self, mask_type: MaskType) -> ColorTable:
+        return self.color_tables[mask_type.color_text_non_text()]
+
+    def pop_unknown_types(self) -> Counter:
+        """
+        (region, type) pairs not known to the color tables and how often they were drawn since the last call.
+        The mask getters (get_mask, get_masks_of_page, ...) do not leave them to the caller, they log them
+        and reset the counts, see log_unknown_types.
+        """
+        unknown_types = Counter()
+        for table in set(self.color_tables.values()):
+            unknown_types.update(table.pop_unknown_types())
+        return unknown_types
+
+    def log_unknown_types(self):
+        """
+        Pops the unknown types and logs the pairs that were not logged by this generator before, so that
+        the counts do not grow without bound when masks are only requested (e.g. in MaskDataset workers).
+        """
+        unknown_types = self.pop_unknown_types()
+        new_types = Counter({pair: count for pair, count in unknown_types.items() if pair not in self.logged_types})
+        self.logged_types.update(new_types)
+        report_unknown_types(new_types)
+
+    def pop_stats(self) -> RunStats:
+        """
+        Stats collected since the last call, None unless the generator collects stats.
+        """
+        stats = self.stats
+        if stats is not None:
+            self.stats = RunStats()
+        return stats
+
+    def pop_class_counts(self) -> ClassCounts:
+        """
+        Class pixel counts since the last call, None unless the generator counts classes.
+        """
+        class_counts = self.class_counts
+        if class_counts is not None:
+            self.class_counts = ClassCounts()
+        return class_counts
+
+    def get_class_names(self) -> Dict[str, Dict[int, List[str]]]:
+        """
+        Names of the class ids of every mask type and scale, by the keys of class_counts.
+        """
+        return {class_counts_key(mask_type, scale): self.get_color_table(mask_type).class_names()
+                for mask_type in self.mask_types for scale in self.scales}
+
+    def get_settings(self, mask_type: MaskType) -> MaskSetting:
+        if mask_type is self.settings.MASK_TYPE:
+            return self.settings
+        return replace(self.settings, MASK_TYPE=mask_type)
+
+    def get_output_name(self, filename: str, mask_type: MaskType, scale: float) -> str:
+        """
+        A single mask type at scale 1.0 keeps the name <name>.mask.<ext>, otherwise the outputs are
+        kept apart as <name>.<type>.<scale>.mask.<ext>.
+        """
+        filename_wo_ext = os.path.splitext(filename)[0]
+        if len(self.mask_types) == 1 and self.scales == [1.0]:
+            return filename_wo_ext + '.mask.' + self.settings.MASK_EXTENSION
+        return '{}.{}.{:g}.mask.{}'.format(filename_wo_ext, mask_type.value, scale, self.settings.MASK_EXTENSION)
+
+    def render(self, page: CompactPageRegions, mask_type: MaskType, scale: float = 1.0, window=None,
+               label_map: bool = None) -> Image:
+        """
+        :param label_map: overrides settings.LABEL_MAP if not None
+        Whole pages, not windows, are counted in class_counts.
+        """
+        settings = self.get_settings(mask_type)
+        if label_map is not None and label_map != settings.LABEL_MAP:
+            settings = replace(settings, LABEL_MAP=label_map)
+        return page_region_to_mask(page, settings, scale=scale, color_table=self.get_color_table(mask_type),
+                                   window=window, stats=self.stats,
+                                   class_counts=self.class_counts if window is None else None)
+
+    def render_all(self, page: CompactPageRegions, label_map: bool = None):
+        """
+        Renders every configured mask type at every configured scale from the same parsed page.
+        Yields (mask_type, scale, mask image).
+        """
+        for mask_type in self.mask_types:
+            for scale in self.scales:
+                yield mask_type, scale, self.render(page, mask_type, scale, label_map=label_map)
+
+    def write(self, file, output_dir, packer=None, writer=None) -> Tuple[List[str], Counter]:
+        """
+        Writes the masks of file to output_dir.
+        Returns the paths of the written masks and the types that were not known for their region.
+        """
         logger.info("Processing: {}".format(file))
-        a = self.get_xml_regions(file, self.settings)
-        mask_pil = page_region_to_mask(a, self.settings)
-        filename_wo_ext = os.path.splitext(a.filename)[0]
-        mask_pil.save(output_dir + filename_wo_ext + '.mask.' + self.settings.MASK_EXTENSION)
+        with timed(self.stats, 'parse'):
+            page = parse_page_xml(file, self.mask_types)
+        return self.write_page(page, output_dir, packer=packer, writer=writer)
 
-    def get_mask(self, file, scale=1.0):
+    def write_page(self, page: CompactPageRegions, output_dir, packer=None, writer=None) -> Tuple[List[str], Counter]:
+        """
+        Writes the masks of a parsed (or compiled) page to output_dir, see write.
+        :param packer: optional pagexml_mask_converter.packed.PackedMaskWriter or
+            pagexml_mask_converter.rle.RLEMaskWriter. The masks are then appended to its shards, named like their
+            image files without extension. Its label_map attribute, if not None, overrides settings.LABEL_MAP.
+        :param writer: optional pagexml_mask_converter.writer.MaskWriter the images are submitted to, with
+            an AsyncMaskWriter they may not be written yet when this returns.
+        """
+        outputs = []
+        label_map = packer.label_map if packer is not None else None
+        for mask_type, scale, mask_pil in self.render_all(page, label_map=label_map):
+            output_name = self.get_output_name(page.filename, mask_type, scale)
+            if packer is not None:
+                with timed(self.stats, 'write'):
+                    outputs.append(packer.add(os.path.splitext(output_name)[0], mask_pil))
+            elif writer is not None:
+                outputs.append(output_dir + output_name)
+                writer.submit(mask_pil, outputs[-1])
+            else:
+                outputs.append(output_dir + output_name)
+                with timed(self.stats, 'write'):
+                    mask_pil.save(outputs[-1])
+        if self.stats is not None:
+            self.stats.count(pages=1, masks=len(outputs))
+        return outputs, self.pop_unknown_types()
+
+    def save(self, file, output_dir):
+        """
+        Writes the masks of file to output_dir and returns the types that were not known for their region.
+        """
+        return self.write(file, output_dir)[1]
+
+    def to_dict(self):
+        """
+        Everything that determines the written masks: settings, mask types, scales and colors.
+        """
+        return {**self.settings.to_dict(),
+                'MASK_TYPES': [mask_type.value for mask_type in self.mask_types],
+                'SCALES': self.scales,
+                'Color_Maps': {mask_type.value: self.get_color_table(mask_type).color_dict
+                               for mask_type in self.mask_types}}
+
+    def get_mask(self, file, scale=1.0, window: Tuple[int, int, int, int] = None):
+        """
+        :param window: optional (x, y, width, height) in pixels of the scaled page. Only this part of the
+            mask is rendered, see page_region_to_mask.
+        """
+        if self.cache is None:
+            a = self.get_xml_regions(file, self.settings)
+            mask = np.array(self.render(a, self.settings.MASK_TYPE, scale, window=window))
+            self.log_unknown_types()
+            return mask
+        with open(file, 'rb') as f:
+            content = f.read()
+        key = self.cache.key(content, self.settings.to_dict(), scale,
+                             self.get_color_table(self.settings.MASK_TYPE).color_dict, window=window)
+        mask = self.cache.get(key)
+        if mask is None:
+            a = parse_page_xml(io.BytesIO(content), self.settings.MASK_TYPE, filename=file)
+            mask = np.array(self.render(a, self.settings.MASK_TYPE, scale, window=window))
+            self.log_unknown_types()
+            self.cache.put(key, mask)
+        return mask
+
+    def get_compiled_mask(self, corpus, index: int, scale=1.0, window: Tuple[int, int, int, int] = None):
+        """
+        Renders the mask of page index of a pagexml_mask_converter.corpus.CompiledCorpus without parsing XML.
+        """
+        mask = np.array(self.render(corpus[index], self.settings.MASK_TYPE, scale, window=window))
+        self.log_unknown_types()
+        return mask
+
+    def iter_mask_tiles(self, file, scale=1.0, tile_size: Tuple[int, int] = (512, 512),
+                        stride: Tuple[int, int] = None):
+        """
+        Parses file once and yields ((x, y, width, height), mask) for tiles covering the scaled page.
+        Tiles at the right and bottom border are cut to the page.
+        """
         a = self.get_xml_regions(file, self.settings)
-        mask_pil = page_region_to_mask(a, self.settings, scale=scale)
-        return np.array(mask_pil)
-
-    def get_xml_regions(self, xml_file, setting: MaskSetting) -> PageRegions:
-        namespaces = {'pcgts': self.xml_namespace}
-        root = ET.parse(xml_file).getroot()
-        region_by_types = []
-        for name, value in namespaces.items():
-            ET.register_namespace(name, value)
-
-        page = root.find('.//pcgts:Page', namespaces)
-        if page is None:
-            # sadly pagexml inconsistent (http, https, ..) -> check all namespaces
-            for i in PCGTSVersion:
-                namespaces['pcgts'] = i.get_namespace()
-                page = root.find('.//pcgts:Page', namespaces)
-                if page is not None:  # Todo synchronize across processes
-                    self.xml_namespace = i.get_namespace()
-                    break
-
-        page_height = page.get('imageHeight')
-        page_width = page.get('imageWidth')
-        xml_f_name = page.get('imageFilename')
-        f_name = os.path.splitext(os.path.basename(xml_file))[0]
-        xml_f_name = os.path.splitext(os.path.basename(xml_f_name))[0]
-        if f_name != xml_f_name:
-            logger.info("Basename of file: {} is different than XML Filename: {}".format(f_name, xml_f_name))
-        for x in page.getchildren():
-            region = x.tag.split("}")[-1]
-            if region not in PageXMLRegionType.get_region_types():
-                logger.warning("{} Not defined. Skipping Region Type".format(region))
-            #print(region)
-                #print(child)
-            if setting.MASK_TYPE == setting.MASK_TYPE.TEXT_NONTEXT or setting.MASK_TYPE == \
-                    setting.MASK_TYPE.ALLTYPES:
-                coords = x.find('pcgts:Coords', namespaces)
-                if coords is not None:
-                    polyline = string_to_lp(coords.get('points'))
-                    xml_type = x.get('type')
-                    region_by_types.append(RegionType(polygon=polyline,
-                                                      region=region,
-                                                      r_type=xml_type))
-
-            if setting.MASK_TYPE == setting.MASK_TYPE.TEXT_LINE:
-                for textline in x.findall('pcgts:TextLine', namespaces):
-                    if textline is not None:
-                        coords = textline.find('pcgts:Coords', namespaces)
-                        if coords is not None:
-                            polyline = string_to_lp(coords.get('points'))
-                            xml_type = x.get('type')
-                            region_by_types.append(RegionType(polygon=polyline,
-                                                              region=region,
-                                                              r_type=xml_type))
-
-            if setting.MASK_TYPE == setting.MASK_TYPE.BASE_LINE:
-                for textline in x.findall('pcgts:TextLine', namespaces):
-                    if textline is not None:
-                        baseline = textline.find('pcgts:Baseline', namespaces)
-                        if baseline is not None:
-                            polyline = string_to_lp(baseline.get('points'))
-                            xml_type = x.get('type')
-                            region_by_types.append(RegionType(polygon=polyline,
-                                                              region=region,
-                                                              r_type=xml_type))
-        return PageRegions(image_size=(int(page_height), int(page_width)), xml_regions=region_by_types, filename=f_name)
+        height, width = a.get_scaled_image_size(scale)
+        tile_width, tile_height = tile_size
+        stride_x, stride_y = stride if stride is not None else tile_size
+        for y in range(0, max(int(height), 1), stride_y):
+            for x in range(0, max(int(width), 1), stride_x):
+                window = clip_window((x, y, tile_width, tile_height), width, height)
+                mask = np.array(self.render(a, self.settings.MASK_TYPE, scale, window=window))
+                self.log_unknown_types()
+                yield window, mask
+
+    def get_masks(self, files, scale=1.0, workers: int = 4, ordered: bool = True):
+        """
+        Renders the masks of many files in parallel, see pagexml_mask_converter.dataset.get_masks.
+        """
+        from pagexml_mask_converter.dataset import get_masks
+        return get_masks(self, files, scale=scale, workers=workers, ordered=ordered)
+
+    def get_masks_of_page(self, file):
+        """
+        Parses file once and returns all configured masks as a dict {(mask_type, scale): mask array}.
+        """
+        a = parse_page_xml(file, self.mask_types)
+        masks = {(mask_type, scale): np.array(mask_pil) for mask_type, scale, mask_pil in self.render_all(a)}
+        self.log_unknown_types()
+        return masks
+
+    def get_xml_regions(self, xml_file, setting: MaskSetting) -> CompactPageRegions:
+        with timed(self.stats, 'parse'):
+            return parse_page_xml(xml_file, setting.MASK_TYPE)
+
+
+class _PageEnd(Exception):
+    pass
+
+
+_REGION_TYPE_NAMES = frozenset(PageXMLRegionType.get_region_types())
+# PAGE elements that never contain an element of their own name, see parse_page_xml
+_FLAT_ELEMENTS = ('TextLine', 'Word', 'Glyph', 'TextEquiv', 'TextStyle', 'Coords', 'Baseline', 'AlternativeImage',
+                  'Graphemes', 'UserDefined', 'Labels', 'Roles')
+
+
+def parse_page_xml(xml_file, mask_types, filename: str = None, problems: List[Dict] = None) -> CompactPageRegions:
+    """
+    Incrementally parses a PageXML file and collects the polygons needed for the given mask type(s).
+    mask_types can be a single MaskType or a list of them. The polygons needed by every one of them
+    are collected in the same pass and can be told apart by the kind_codes of the returned page.
+    xml_file can be a path or a file object, filename is then used to name the page.
+
+    The namespace is taken from the root element, so every PCGTS version (http and https) is handled
+    in a single pass. The file is streamed through expat without building a tree. Only attributes of Page,
+    its direct region children, their Coords/TextLine children and the TextLines' Coords/Baseline are read,
+    everything else (Words, Glyphs, TextEquivs, ...) is skipped as it streams by.
+
+    With a problems list, the page is validated while it is parsed: an unknown namespace, undefined region
+    elements, a missing Page or image size and polygons with malformed points, too few points or points
+    outside of the image are appended to it as {'problem', 'element', 'message'} instead of being logged
+    or raised. Polygons with malformed points are left out, None is returned if the page cannot be built.
+    XML syntax errors are still raised.
+    """
+    if isinstance(mask_types, MaskType):
+        mask_types = [mask_types]
+    kinds = {mask_type.polygon_kind() for mask_type in mask_types}
+    collect_regions = KIND_REGION in kinds
+    collect_lines = KIND_TEXT_LINE in kinds
+    collect_baselines = KIND_BASELINE in kinds
+
+    builder = _PageBuilder(problems)
+    parser = expat.ParserCreate(namespace_separator='}')
+    # expat names are "<namespace>}<tag>", the tags are set from the namespace of the root element
+    prefix = page_tag = coords_tag = text_line_tag = baseline_tag = None
+    flat_tags = set()
+    page = None
+    page_depth = None
+    depth = -1
+    skip_depth = None
+    skip_name = None
+    region = None
+    xml_type = None
+    region_id = None
+    region_has_coords = False
+    line_id = None
+    line_has_coords = False
+    line_has_baseline = False
+
+    # the handlers are closures, which is noticeably faster than methods for the many elements skipped. The
+    # subtree of an element that cannot contain its own name is skipped without a start handler by waiting
+    # for its end tag, which saves a call for every element in it (Words, Glyphs, TextEquivs, ...)
+
+    def skip_children(name):
+        nonlocal skip_depth, skip_name
+        if name in flat_tags:
+            skip_name = name
+            parser.StartElementHandler = None
+            parser.EndElementHandler = skip_to_end
+        else:
+            skip_depth = depth
+            parser.StartElementHandler = skip_start
+            parser.EndElementHandler = skip_end
+
+    def skip_start(name, attrs):
+        nonlocal depth
+        depth += 1
+
+    def skip_end(name):
+        nonlocal depth
+        depth -= 1
+        if depth < skip_depth:
+            parser.StartElementHandler = start
+            parser.EndElementHandler = end
+
+    def skip_to_end(name):
+        nonlocal depth
+        if name == skip_name:
+            depth -= 1
+            parser.StartElementHandler = start
+            parser.EndElementHandler = end
+
+    def start(name, attrs):
+        nonlocal depth, prefix, page_tag, coords_tag, text_line_tag, baseline_tag, flat_tags, page, page_depth, \
+            region, xml_type, region_id, region_has_coords, line_id, line_has_coords, line_has_baseline
+        depth += 1
+        if page_depth is None:
+            if depth == 0:
+                namespace, separator, _ = name.rpartition('}')
+                namespace = namespace if separator else None
+                if PCGTSVersion.from_namespace(namespace) is None:
+                    if problems is not None:
+                        problems.append(_problem('unknown_namespace', "Unknown PageXML namespace {}".format(namespace)))
+                    else:
+                        logger.warning("Unknown PageXML namespace {} in {}".format(namespace, xml_file))
+                prefix = namespace + '}' if namespace is not None else ''
+                page_tag, coords_tag = prefix + 'Page', prefix + 'Coords'
+                text_line_tag, baseline_tag = prefix + 'TextLine', prefix + 'Baseline'
+                flat_tags = {prefix + tag for tag in _FLAT_ELEMENTS}
+            elif name == page_tag:
+                page = (attrs.get('imageHeight'), attrs.get('imageWidth'), attrs.get('imageFilename'))
+                page_depth = depth
+            return
+        level = depth - page_depth
+        if level == 1:
+            tag = name[len(prefix):] if name.startswith(prefix) else None
+            if tag not in _REGION_TYPE_NAMES:
+                if tag is not None:
+                    if problems is not None:
+                        problems.append(_problem('unknown_region', "{} Not defined".format(tag), attrs.get('id')))
+                    else:
+                        logger.warning("{} Not defined. Skipping Region Type".format(tag))
+                skip_children(name)
+                return
+            region = tag
+            xml_type = attrs.get('type')
+            region_id = attrs.get('id') if problems is not None else None
+            region_has_coords = False
+        elif level == 2:
+            if name == text_line_tag and (collect_lines or collect_baselines):
+                line_id = attrs.get('id') if problems is not None else None
+                line_has_coords = False
+                line_has_baseline = False
+                return
+            if name == coords_tag and collect_regions and not region_has_coords:
+                region_has_coords = True
+                builder.add_points(attrs.get('points'), region, xml_type, KIND_REGION, region_id)
+            skip_children(name)
+        else:
+            # only TextLines are entered, nothing below their Coords and Baseline is read
+            if name == coords_tag:
+                if collect_lines and not line_has_coords:
+                    line_has_coords = True
+                    builder.add_points(attrs.get('points'), region, xml_type, KIND_TEXT_LINE, line_id)
+            elif name == baseline_tag:
+                if collect_baselines and not line_has_baseline:
+                    line_has_baseline = True
+                    builder.add_points(attrs.get('points'), region, xml_type, KIND_BASELINE, line_id)
+            skip_children(name)
+
+    def end(name):
+        nonlocal depth
+        if depth == page_depth:
+            # nothing after the Page is needed
+            raise _PageEnd()
+        depth -= 1
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    try:
+        if hasattr(xml_file, 'read'):
+            parser.Parse(xml_file.read(), True)
+        else:
+            with open(xml_file, 'rb') as f:
+                parser.ParseFile(f)
+    except _PageEnd:
+        pass
+    except expat.ExpatError as e:
+        error = ET.ParseError(expat.ErrorString(e.code) + ": line {}, column {}".format(e.lineno, e.offset))
+        error.code, error.position = e.code, (e.lineno, e.offset)
+        raise error from None
+
+    if page is None:
+        if problems is not None:
+            problems.append(_problem('missing_page', "No Page element found"))
+            return None
+        raise ValueError("No Page element found in {}".format(xml_file))
+    page_height, page_width, xml_f_name = page
+    f_name = os.path.splitext(os.path.basename(filename or xml_file))[0]
+    xml_f_name = os.path.splitext(os.path.basename(xml_f_name or ''))[0]
+    if f_name != xml_f_name:
+        logger.info("Basename of file: {} is different than XML Filename: {}".format(f_name, xml_f_name))
+    try:
+        image_size = (int(page_height), int(page_width))
+    except (TypeError, ValueError):
+        if problems is None:
+            raise ValueError("Invalid imageWidth {!r} or imageHeight {!r} in {}".format(page_width, page_height,
+                                                                                       xml_file))
+        problems.append(_problem('bad_image_size', "Invalid imageWidth {!r} or imageHeight {!r}".format(
+            page_width, page_height)))
+        return None
+    page_region = builder.build(image_size, f_name)
+    if problems is not None:
+        builder.check(page_region)
+    return page_region
 
 
 def string_to_lp(points: str):
@@ -184,99 +764,312 @@ def string_to_lp(points: str):
     return lp_points
 
 
-def page_region_to_mask(page_region: PageRegions, setting: MaskSetting, scale: float = 1.0) -> Image:
+def string_to_array(points: str) -> np.ndarray:
+    coords, _ = points_to_array([points])
+    return coords
+
+
+def points_to_array(points: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parses many PageXML points strings ("x1,y1 x2,y2 ...") at once.
+    Returns the (N, 2) int32 coordinates of all strings and the number of points of each string.
+    Raises a ValueError if a point is not two integers separated by one comma.
+    """
+    counts = np.array([p.count(',') if p else 0 for p in points], dtype=np.int64)
+    text = ' '.join(p for p in points if p)
+    values = np.fromstring(text.replace(',', ' '), dtype=np.int32, sep=' ')
+    if values.size != 2 * counts.sum() or not _one_comma_per_point(text):
+        raise ValueError("Malformed points attribute")
+    return values.reshape(-1, 2), counts
+
+
+def _one_comma_per_point(text: str) -> bool:
+    """
+    Whether every whitespace separated token of text has exactly one comma. Otherwise the numbers of a
+    malformed point would be paired with the ones of the next points (or strings) without notice.
+    """
+    chars = np.frombuffer(text.encode(), dtype=np.uint8)
+    space = np.isin(chars, np.frombuffer(b' \t\n\r\f\v', dtype=np.uint8))
+    starts = ~space
+    starts[1:] &= space[:-1]
+    token = np.cumsum(starts)
+    commas = np.bincount(token[chars == ord(',')], minlength=token[-1] + 1 if len(token) else 1)
+    return bool((commas[1:] == 1).all())
+
+
+def polygon_classes(page_region: CompactPageRegions, color_table: ColorTable) -> np.ndarray:
+    """
+    Looks up the class id of every polygon of the page, -1 for polygons that are not drawn.
+    Each distinct (region, type) pair of the page is resolved only once.
+    """
+    pairs = page_region.region_codes.astype(np.int32) * (len(page_region.r_types) + 1) + page_region.type_codes + 1
+    unique_pairs, inverse, counts = np.unique(pairs, return_inverse=True, return_counts=True)
+    lookup = np.empty(len(unique_pairs), dtype=np.int16)
+    for i, (pair, count) in enumerate(zip(unique_pairs.tolist(), counts.tolist())):
+        region_code, type_code = divmod(pair, len(page_region.r_types) + 1)
+        r_type = page_region.r_types[type_code - 1] if type_code > 0 else None
+        class_id = color_table.get_class(REGION_TYPES[region_code], r_type, count=count)
+        lookup[i] = class_id if class_id is not None else -1
+    return lookup[inverse.reshape(-1)]
+
+
+def baseline_markers(starts: np.ndarray, ends: np.ndarray, length: int, line_width: int,
+                     max_width: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    End markers of a batch of baselines from their start and end points (each (N, 2)).
+    A marker is a line of 2 * length pixels perpendicular to the baseline through its end point, which is moved
+    outwards by half the line width (as long as it stays inside the page).
+
+    Returns the markers as (N, 2, 2) arrays of truncated pixel coordinates and a mask of the baselines that
+    have markers. Baselines whose start and end point are equal have no direction and get none.
+    """
+    starts, ends = starts.astype(np.int64), ends.astype(np.int64)
+    direction = ends - starts
+    magnitude = np.sqrt((direction * direction).sum(axis=1).astype(np.float64))
+    valid = magnitude > 0
+    safe_magnitude = np.where(valid, magnitude, 1.0)
+    unit_x, unit_y = direction[:, 0] / safe_magnitude, direction[:, 1] / safe_magnitude
+
+    half_width = (line_width + 1) / 2
+    end_x = ends[:, 0].astype(np.float64)
+    end_x = np.where((direction[:, 0] > 0) & (max_width > end_x + half_width), end_x + half_width, end_x)
+    end_x = np.where((direction[:, 0] < 0) & (0 < end_x - half_width), end_x - half_width, end_x)
+    end_y = ends[:, 1].astype(np.float64)
+
+    # perpendicular (-unit_y, unit_x), one point on either side of the end point
+    markers = np.stack([
+        np.stack([end_x + -unit_y * length, end_y + unit_x * length], axis=1),
+        np.stack([end_x + -unit_y * -length, end_y + unit_x * -length], axis=1),
+    ], axis=1)
+    # PIL truncates coordinates towards zero
+    return np.trunc(markers).astype(np.int64), valid
+
+
+def baseline_draw_list(page_region: CompactPageRegions, scaled_coords: np.ndarray, width: int, line_width: int,
+                       marker_length: int, line_class: int, marker_class: int) -> DrawList:
+    """
+    Baselines followed by the markers at their end and start, in this order for every baseline. The markers of
+    all baselines are computed at once. Class ids < 0 leave out the lines or markers, baselines with less than
+    two points are left out completely.
+    """
+    counts = np.diff(page_region.offsets)
+    drawn = np.flatnonzero(counts >= 2)
+    starts, ends = scaled_coords[page_region.offsets[drawn]], scaled_coords[page_region.offsets[drawn + 1] - 1]
+    end_markers, end_valid = baseline_markers(starts, ends, marker_length, line_width, width)
+    start_markers, start_valid = baseline_markers(ends, starts, marker_length, line_width, width)
+
+    # shapes are ranges of a point array holding the baseline points followed by the marker points
+    marker_points = np.stack([end_markers, start_markers], axis=1).reshape(-1, 2)
+    points = np.concatenate([scaled_coords.astype(np.int64), marker_points])
+    baselines = np.arange(len(drawn))
+    shape_baselines = [baselines]
+    shape_starts = [page_region.offsets[drawn]]
+    shape_counts = [counts[drawn]]
+    shape_values = [np.full(len(drawn), line_class)]
+    if line_class < 0:
+        shape_baselines, shape_starts, shape_counts, shape_values = [], [], [], []
+    if marker_length != 0 and marker_class >= 0:
+        for i, valid in enumerate((end_valid, start_valid)):
+            shape_baselines.append(baselines[valid])
+            shape_starts.append(len(scaled_coords) + 4 * baselines[valid] + 2 * i)
+            shape_counts.append(np.full(np.count_nonzero(valid), 2))
+            shape_values.append(np.full(np.count_nonzero(valid), marker_class))
+    if not shape_baselines:
+        return DrawList.from_shapes([], [], [])
+    shape_baselines = np.concatenate(shape_baselines)
+    # stable sort keeps line, end marker, start marker for every baseline
+    order = np.argsort(shape_baselines, kind='stable')
+    return DrawList.gather(points, np.concatenate(shape_starts)[order], np.concatenate(shape_counts)[order],
+                           np.concatenate(shape_values)[order], np.full(len(order), line_width))
+
+
+def clip_window(window, width, height) -> Tuple[int, int, int, int]:
+    """
+    Clips a window (x, y, width, height) to an image of the given size.
+    """
+    x, y, w, h = window
+    x0, y0 = max(0, int(x)), max(0, int(y))
+    x1, y1 = min(int(width), int(x) + int(w)), min(int(height), int(y) + int(h))
+    return x0, y0, max(0, x1 - x0), max(0, y1 - y0)
+
+
+def class_counts_key(mask_type: MaskType, scale: float) -> str:
+    return '{}.{:g}'.format(mask_type.value, scale)
+
+
+def page_region_to_mask(page_region: PageRegions, setting: MaskSetting, scale: float = 1.0,
+                        color_table: ColorTable = None, window: Tuple[int, int, int, int] = None,
+                        stats: RunStats = None, class_counts: ClassCounts = None) -> Image:
+    """
+    Renders the page into a palette ("P" mode) image holding class ids if setting.LABEL_MAP is set, the
+    palette maps every class id to its color. Otherwise an RGB image is returned, which the rasterizer draws
+    in the colors of the classes directly if it can.
+
+    window (x, y, width, height) in pixels of the scaled page restricts rendering to that part of the page.
+    Only polygons whose bounding box intersects the window are drawn, and only the rows of the window are
+    allocated. The result equals the same window cut out of the full mask. The window is clipped to the page.
+
+    With stats, the time spent on resolving classes and drawing, the regions and points drawn and the size
+    of the canvas are recorded. With setting.SIMPLIFY, the polygons are simplified after scaling, see
+    pagexml_mask_converter.simplify.simplify_polygons. With class_counts, the pixels of every class are
+    counted under the page's filename and class_counts_key.
+    """
+    start = time.perf_counter()
+    page_region = CompactPageRegions.from_page_regions(page_region, kind=setting.MASK_TYPE.polygon_kind())
+    page_region = page_region.select(setting.MASK_TYPE.polygon_kind())
+    if color_table is None:
+        color_table = ColorTable.from_page_xml_types(color_text_non_text=setting.MASK_TYPE.color_text_non_text())
+    palette = color_table.palette
+
     height, width = page_region.get_scaled_image_size(scale)
-    pil_image = Image.new('RGB', (width, height), (255, 255, 255))
-    for x in page_region.xml_regions:
-        polygon = x.get_scaled_image_region(scale)
-        if setting.MASK_TYPE is MaskType.ALLTYPES:
-            if len(polygon) >= 2:
-                ImageDraw.Draw(pil_image).polygon(polygon.flatten().tolist(),
-                                                  outline=PageXMLRegionType(x.region).get_region_type_color(x.r_type),
-                                                  fill=PageXMLRegionType(x.region).get_region_type_color(x.r_type))
-        elif setting.MASK_TYPE is MaskType.TEXT_NONTEXT:
-            if len(polygon) >= 2:
-                ImageDraw.Draw(pil_image).polygon(polygon.flatten().tolist(),
-                                                  outline=PageXMLRegionType(x.region).
-                                                  get_region_type_color(x.r_type, color_text_non_text=True),
-                                                  fill=PageXMLRegionType(x.region).
-                                                  get_region_type_color(x.r_type, color_text_non_text=True)),
-        elif setting.MASK_TYPE is MaskType.BASE_LINE:
-            if len(polygon) >= 2:
-                ImageDraw.Draw(pil_image).line(polygon.flatten().tolist(),
-                                               fill=PageXMLRegionType("TextRegion").
-                                               get_region_type_color(None, color_text_non_text=True),
-                                               width=setting.LINEWIDTH)
-                if setting.BASELINELENGTH != 0:
-                    from math import sqrt
-
-                    def getPoint(p1, p2, length=20, max_width=None, max_height=None, lw=5):
-                        x1, y1 = p1
-                        x2, y2 = p2
-
-                        x3 = x2 - x1
-                        y3 = y2 - y1
-                        lw = lw + 1
-                        if x2 > x1:
-                            if max_width > x2 + lw / 2:
-                                x2 = x2 + lw / 2
-                        if x2 < x1:
-                            if 0 < x2 - lw / 2:
-                                x2 = x2 - lw / 2
-                        mag = sqrt(x3 * x3 + y3 * y3)
-                        x3 = x3 / mag
-                        y3 = y3 / mag
-
-                        temp = x3
-                        x3 = -y3
-                        y3 = temp
-
-                        xl1 = x2 + x3 * length
-                        xl2 = x2 + x3 * -length
-
-                        yl1 = y2 + y3 * length
-                        yl2 = y2 + y3 * -length
-
-                        return (xl1, yl1), (xl2, yl2)
-
-                    start, end = polygon[0], polygon[-1]
-                    l1 = getPoint(start, end, setting.BASELINELENGTH, max_width=width, max_height=height,lw=setting.LINEWIDTH)
-                    l2 = getPoint(end, start, setting.BASELINELENGTH, max_width=width, max_height=height, lw=setting.LINEWIDTH)
-
-                    ImageDraw.Draw(pil_image).line(l1,
-                                                   fill=PageXMLRegionType("GraphicRegion").
-                                                   get_region_type_color(None,
-                                                                         color_text_non_text=True),
-                                                   width=setting.LINEWIDTH)
-                    ImageDraw.Draw(pil_image).line(l2,
-                                                   fill=PageXMLRegionType("GraphicRegion").
-                                                   get_region_type_color(None,
-                                                                         color_text_non_text=True),
-                                                   width=setting.LINEWIDTH)
-
-        elif setting.MASK_TYPE is MaskType.TEXT_LINE:
-            if len(polygon) >= 2:
-                ImageDraw.Draw(pil_image).polygon(polygon.flatten().tolist(),
-                                                  outline=PageXMLRegionType(x.region).get_region_type_color(x.r_type),
-                                                  fill=PageXMLRegionType(x.region).get_region_type_color(x.r_type))
-
-    return pil_image
+    scaled_coords = page_region.get_scaled_coords(scale)
+    if window is None:
+        origin_x, origin_y, window_width, window_height = 0, 0, width, height
+    else:
+        origin_x, origin_y, window_width, window_height = clip_window(window, width, height)
+        # lines and end markers reach beyond the points of a baseline
+        margin = 1 if setting.MASK_TYPE is not MaskType.BASE_LINE else \
+            setting.LINEWIDTH + abs(setting.BASELINELENGTH) + 2
+        bounds = page_region.get_bounds(scaled_coords)
+        visible = (bounds[:, 0] < origin_x + window_width + margin) & (bounds[:, 2] >= origin_x - margin) & \
+                  (bounds[:, 1] < origin_y + window_height + margin) & (bounds[:, 3] >= origin_y - margin)
+        counts = np.diff(page_region.offsets)
+        page_region = page_region.select_polygons(visible)
+        scaled_coords = scaled_coords[np.repeat(visible, counts)]
+    if setting.SIMPLIFY:
+        simplify_start = time.perf_counter()
+        keep, offsets = simplify_polygons(scaled_coords, page_region.offsets, setting.SIMPLIFY_TOLERANCE,
+                                          lines=setting.MASK_TYPE is MaskType.BASE_LINE)
+        page_region = page_region._replace(coords=page_region.coords[keep], offsets=offsets)
+        scaled_coords = scaled_coords[keep]
+        if stats is not None:
+            elapsed = time.perf_counter() - simplify_start
+            stats.add_time('simplify', elapsed)
+            # not part of the classes stage
+            start += elapsed
+    if setting.MASK_TYPE is MaskType.BASE_LINE:
+        line_class, marker_class = (-1 if class_id is None else class_id for class_id in
+                                    (color_table.get_class("TextRegion"), color_table.get_class("GraphicRegion")))
+        draw_list = baseline_draw_list(page_region, scaled_coords, width, setting.LINEWIDTH,
+                                       setting.BASELINELENGTH, line_class, marker_class)
+    else:
+        classes = polygon_classes(page_region, color_table)
+        counts = np.diff(page_region.offsets)
+        drawn = (counts >= 2) & (classes >= 0)
+        draw_list = DrawList.gather(scaled_coords, page_region.offsets[:-1][drawn], counts[drawn], classes[drawn],
+                                    np.zeros(np.count_nonzero(drawn)))
+    if stats is not None:
+        stats.add_time('classes', time.perf_counter() - start)
+        stats.count(regions=page_region.num_polygons, points=len(scaled_coords))
+        stats.canvas(window_width, window_height)
+
+    rasterizer = setting.RASTERIZER.get_rasterizer()
+    window = (origin_x, origin_y, window_width, window_height)
+    with timed(stats, 'draw'):
+        if not setting.LABEL_MAP and class_counts is None:
+            return rasterizer.render_rgb(draw_list, (width, height), window, palette)
+        pil_image = rasterizer.render(draw_list, (width, height), window)
+        if class_counts is not None:
+            class_counts.add(class_counts_key(setting.MASK_TYPE, scale), page_region.filename, pil_image,
+                             num_classes=len(palette))
+        pil_image.putpalette([channel for color in palette for channel in color])
+        if setting.LABEL_MAP:
+            return pil_image
+        return pil_image.convert('RGB')
+
+
+# mask extensions that store "P" mode images with their class ids
+LABEL_MAP_EXTENSIONS = ('png', 'dib', 'gif', 'im', 'pcx', 'tga', 'tiff')
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input_dir", type=str, required=True,
-                        help="Image directory to process")
-    parser.add_argument("--output_dir", type=str, required=True,
+    parser.add_argument("--input_dir", type=str, default=None,
+                        help="Directory of PageXML files or a glob pattern of them (** matches subdirectories)")
+    parser.add_argument("--file_list", type=str, default=None,
+                        help="Text file with one PageXML file per line, - reads the list from stdin")
+    parser.add_argument("--recursive", action="store_true",
+                        help="Also convert the files in the subdirectories of --input_dir. Masks are named after "
+                             "the file only, a file with the name of an earlier one fails instead of overwriting "
+                             "its masks")
+    parser.add_argument("--shard_index", "--shard-index", type=int, default=0,
+                        help="Convert only this shard of the files (0 based), see --num_shards")
+    parser.add_argument("--num_shards", "--num-shards", type=int, default=1,
+                        help="Split the files by a hash of their path into this many disjoint shards, e.g. to "
+                             "convert them on several machines")
+    parser.add_argument("--output_dir", type=str, default=None,
                         help="The output dir for the mask files")
+    parser.add_argument("--output_format", default='image', choices=['image', 'packed', 'rle'],
+                        help="Write a mask image per page, pack the uint8 mask arrays into large memory mappable "
+                             "shard files with an index, which pagexml_mask_converter.packed.PackedMasks reads, or "
+                             "append the COCO RLE of every class of the label maps to json lines shard files, which "
+                             "pagexml_mask_converter.rle.RLEMasks reads (default: %(default)s)")
+    parser.add_argument("--shard_size", type=int, default=None,
+                        help="Maximum size in MiB of a shard file of --output_format packed or rle "
+                             "(default: 4096 for packed, 1024 for rle)")
+    parser.add_argument("--writer_threads", type=int, default=2,
+                        help="Threads per process encoding and writing the mask images while the next masks are "
+                             "rendered, 0 writes them in the rendering thread (default: %(default)s)")
+    parser.add_argument("--max_pending", type=int, default=8,
+                        help="Maximum number of rendered masks per process waiting to be written "
+                             "(default: %(default)s)")
+    parser.add_argument("--png_compress_level", type=int, default=None, choices=range(10), metavar="[0-9]",
+                        help="zlib level of png masks, lower is faster and larger (default: PIL's default)")
+    parser.add_argument("--webp_lossless", action="store_true", help="Write webp masks lossless")
+    parser.add_argument("--tiff_compression", type=str, default=None,
+                        help="Compression of tiff masks, e.g. tiff_lzw, tiff_adobe_deflate or packbits")
+    parser.add_argument("--validate", type=str, default=None, metavar="REPORT_FILE",
+                        help="Only parse the input files and write the problems found in every file to this json "
+                             "lines file ('-' for stdout) instead of writing masks. Exits with 1 if there are any")
+    parser.add_argument("--validate_all", action="store_true",
+                        help="Write a line for every file to the --validate report, not only for files with problems")
+    parser.add_argument("--compile", type=str, default=None, metavar="CORPUS_DIR",
+                        help="Parse the input files once into a compiled corpus in this directory instead of "
+                             "writing masks")
+    parser.add_argument("--corpus", type=str, default=None, metavar="CORPUS_DIR",
+                        help="Render the pages of a corpus compiled with --compile instead of parsing input files")
+    parser.add_argument("--serve", type=int, default=None, metavar="PORT",
+                        help="Serve the masks of the input files or --corpus over HTTP on this port instead of "
+                             "writing them, see pagexml_mask_converter.server.MaskClient")
+    parser.add_argument("--host", type=str, default='127.0.0.1', help="Address --serve listens on "
+                                                                     "(default: %(default)s)")
+    parser.add_argument("--socket", type=str, default=None,
+                        help="Serve on this Unix socket instead of a port")
+    parser.add_argument("--cache_mb", type=int, default=1024,
+                        help="Memory in MiB for the rendered masks kept by the server (default: %(default)s)")
+    parser.add_argument("--page_cache", type=int, default=256,
+                        help="Number of parsed pages kept by the server (default: %(default)s)")
     parser.add_argument("--processes", type=int, default=4,
-                        help="The output dir for the mask files")
+                        help="Number of worker processes, 0 or 1 converts the files in this process")
+    parser.add_argument("--chunksize", type=int, default=8,
+                        help="Number of files handed to a worker process at once")
+    parser.add_argument("--error_report", type=str, default=None,
+                        help="Json file listing the files that could not be converted "
+                             "(default: errors.json in the output dir, written only if a file failed)")
+    parser.add_argument("--no_progress", action="store_true", help="Do not print progress and throughput")
+    parser.add_argument("--stats", nargs='?', const='', default=None, metavar="JSON_FILE",
+                        help="Time the stages of the conversion in every worker and write the merged stats as json "
+                             "(default when given: stats.json in the output dir)")
+    parser.add_argument("--class_stats", action="store_true",
+                        help="Count the pixels of every class while rendering, in total and per page, and write "
+                             "them with class frequencies and weights to class_stats.json in the output dir. With "
+                             "--incremental, the skipped files keep their counts of the earlier runs")
+    parser.add_argument("--profile_dir", type=str, default=None,
+                        help="Profile a sample of the pages with cProfile and write the .prof files to this dir")
+    parser.add_argument("--profile_every", type=int, default=100,
+                        help="Profile every n-th page of every process, see --profile_dir (default: %(default)s)")
+    parser.add_argument("--incremental", nargs='?', const='mtime', default=None, choices=['mtime', 'hash'],
+                        help="Keep a manifest in the output dir and only convert new or changed files. Files are "
+                             "compared by size and modification time, with hash also by content "
+                             "(default when given: %(const)s)")
+    parser.add_argument("--prune", action="store_true",
+                        help="With --incremental, delete the masks of files that do not exist anymore")
     parser.add_argument('--setting',
-                        default='all_types',
-                        const='all_types',
-                        nargs='?',
+                        default=['all_types'],
+                        nargs='+',
                         choices=['all_types', 'text_non_text', 'baseline', 'text_line'],
-                        help='Settings for the mask generation (default: %(default)s)')
+                        help='Settings for the mask generation, several mask types are rendered from a single '
+                             'parse of each file (default: %(default)s)')
     parser.add_argument('--mask_extension',
                         default='png',
                         const='png',
@@ -293,21 +1086,94 @@ def main():
     parser.add_argument('--line_width', type=int, default=7, help='Width of the line to be drawn')
     parser.add_argument('--baseline_length', type=int, default=15, help='Length of the line to be drawn at '
                                                                         'the end of the baseline')
-    parser.add_argument('--scale', type=float, default=1.0, help='Scalefactor')
+    parser.add_argument('--scale', type=float, default=[1.0], nargs='+', help='Scalefactor(s)')
     parser.add_argument('--setting_output', action="store_true")
     parser.add_argument('--color_legend', action="store_true")
+    parser.add_argument('--color_map', type=str, default=None,
+                        help='Json file with the colors to use, in the format of the Color_Map of mask_setting.json')
+    parser.add_argument('--label_map', action="store_true",
+                        help='Write single channel class id masks with a color palette instead of RGB masks')
+    parser.add_argument('--simplify', type=float, nargs='?', const=0.0, default=None, metavar="TOLERANCE",
+                        help='Remove duplicate and horizontally or vertically collinear polygon vertices after '
+                             'scaling, which does not change the masks. With a tolerance in mask pixels, also remove '
+                             'all collinear vertices and vertices closer than that to the simplified polygon '
+                             '(Douglas-Peucker), which may change some edge pixels')
+    parser.add_argument('--rasterizer', default='pil', choices=[backend.value for backend in RasterizerBackend],
+                        help='Backend drawing the masks, numpy fills all polygons of a page at once. Both draw '
+                             'the same masks, numpy is slower (about 3x for regions, up to 5x for baselines on '
+                             'dense pages) (default: %(default)s)')
     args = parser.parse_args()
-    pool = multiprocessing.Pool(int(args.processes))
-    mask_gen = MaskGenerator(MaskSetting(MASK_TYPE=MaskType(args.setting), MASK_EXTENSION=args.mask_extension,
+    if args.prune and not args.incremental:
+        parser.error("--prune requires --incremental")
+    if args.input_dir is None and args.file_list is None and args.corpus is None:
+        parser.error("one of --input_dir, --file_list and --corpus is required")
+    serve = args.serve is not None or args.socket is not None
+    if args.output_dir is None and args.compile is None and args.validate is None and not serve:
+        parser.error("--output_dir is required")
+    if args.corpus is not None and args.incremental:
+        parser.error("--incremental does not work with --corpus")
+    if args.corpus is not None and args.validate is not None:
+        parser.error("--validate checks input files, not a --corpus")
+    if not 0 <= args.shard_index < args.num_shards:
+        parser.error("--shard_index has to be in [0, --num_shards)")
+    if args.label_map and args.output_format == 'image' and args.mask_extension not in LABEL_MAP_EXTENSIONS:
+        parser.error("--label_map needs a --mask_extension that stores palette images: {}".format(
+            ', '.join(LABEL_MAP_EXTENSIONS)))
+    mask_types = [MaskType(setting) for setting in args.setting]
+    mask_gen = MaskGenerator(MaskSetting(MASK_TYPE=mask_types[0], MASK_EXTENSION=args.mask_extension,
                                          PCGTS_VERSION=PCGTSVersion(args.pcgts_version), LINEWIDTH=args.line_width,
-                                         BASELINELENGTH=args.baseline_length))
-    files = glob.glob(args.input_dir)
-    from pagexml_mask_converter.data import PageXMLRegionType
+                                         BASELINELENGTH=args.baseline_length, LABEL_MAP=args.label_map,
+                                         RASTERIZER=RasterizerBackend(args.rasterizer),
+                                         SIMPLIFY=args.simplify is not None,
+                                         SIMPLIFY_TOLERANCE=args.simplify or 0.0),
+                             color_map=args.color_map, mask_types=mask_types, scales=args.scale,
+                             collect_stats=args.stats is not None, count_classes=args.class_stats)
+    from pagexml_mask_converter.discovery import iter_inputs, select_shard, shard_of
+    corpus = None
+    if args.corpus is not None:
+        from pagexml_mask_converter.corpus import CompiledCorpus
+        corpus = CompiledCorpus(args.corpus)
+        files = [index for index, source in enumerate(corpus.sources)
+                 if args.num_shards == 1 or shard_of(source, args.num_shards) == args.shard_index]
+    else:
+        files = iter_inputs(args.input_dir, args.file_list, recursive=args.recursive)
+        if args.num_shards > 1:
+            root = args.input_dir if args.input_dir is not None and os.path.isdir(args.input_dir) else None
+            files = select_shard(files, args.shard_index, args.num_shards, root=root)
+    if args.validate is not None:
+        from pagexml_mask_converter.validate import validate
+        summary = validate(files, args.validate, mask_types, mask_gen.get_color_table(mask_gen.settings.MASK_TYPE),
+                           processes=args.processes, chunksize=args.chunksize, all_files=args.validate_all)
+        print("Validated {} files in {:.1f}s, {} with problems{}".format(
+            summary['files'], summary['seconds'], summary['files_with_problems'],
+            ''.join(', {} {}'.format(count, problem) for problem, count in summary['problems'].items())),
+            file=sys.stderr)
+        return 1 if summary['files_with_problems'] else 0
+    if args.compile is not None:
+        from pagexml_mask_converter.corpus import compile_corpus
+        num_pages = compile_corpus(files, args.compile, processes=args.processes, chunksize=args.chunksize)
+        logger.info("Compiled {} pages into {}".format(num_pages, args.compile))
+        return 0
+    if serve:
+        from pagexml_mask_converter.server import MaskServer
+        server = MaskServer(mask_gen, files=files if corpus is None else (), corpus=corpus,
+                            cache_bytes=args.cache_mb << 20, page_cache_size=args.page_cache,
+                            threads=max(args.processes, 1))
+        address = args.socket or '{}:{}'.format(args.host, args.serve)
+        print("Serving {} pages on {}".format(len(server.sources), address), file=sys.stderr)
+        server.run(args.host, args.serve, socket_path=args.socket)
+        return 0
     if args.setting_output or args.color_legend:
-        t_nt = False if mask_gen.settings.MASK_TYPE is MaskType.ALLTYPES else True
-        color_dict = PageXMLRegionType.to_dict(color_text_non_text=t_nt)
+        color_table = mask_gen.get_color_table(mask_gen.settings.MASK_TYPE)
         setting_dict = mask_gen.settings.to_dict()
-        _comp = {**setting_dict, **{'Color_Map': color_dict}}
+        _comp = {**setting_dict, **{'Color_Map': color_table.color_dict}}
+        if mask_gen.settings.LABEL_MAP:
+            _comp['Class_Palette'] = color_table.palette
+        if len(mask_gen.mask_types) > 1 or mask_gen.scales != [1.0]:
+            _comp['MASK_TYPES'] = [mask_type.value for mask_type in mask_gen.mask_types]
+            _comp['SCALES'] = mask_gen.scales
+            _comp['Color_Maps'] = {mask_type.value: mask_gen.get_color_table(mask_type).color_dict
+                                   for mask_type in mask_gen.mask_types}
         t = json.dumps(_comp, indent=4)
         from pagexml_mask_converter.color_legend import color_legend
         if args.setting_output:
@@ -317,9 +1183,58 @@ def main():
             image = color_legend(t)
             image.save(os.path.join(args.output_dir, "image_palette.png"))
 
-    from itertools import product
-    pool.starmap(mask_gen.save, product(files, [args.output_dir]))
+    from pagexml_mask_converter.driver import run
+    from pagexml_mask_converter.manifest import Manifest
+    from pagexml_mask_converter.stats import SampledProfiler
+    from pagexml_mask_converter.writer import EncoderOptions
+    manifest = Manifest(args.output_dir, mask_gen.to_dict(), use_hash=args.incremental == 'hash') \
+        if args.incremental else None
+    try:
+        report = run(mask_gen, files, args.output_dir, processes=args.processes, chunksize=args.chunksize,
+                     progress=not args.no_progress, manifest=manifest, corpus=corpus,
+                     output_format=args.output_format,
+                     shard_size=args.shard_size << 20 if args.shard_size is not None else None,
+                     encoder_options=EncoderOptions(png_compress_level=args.png_compress_level,
+                                                    webp_lossless=args.webp_lossless,
+                                                    tiff_compression=args.tiff_compression),
+                     writer_threads=args.writer_threads, max_pending=args.max_pending,
+                     profiler=SampledProfiler(args.profile_dir, args.profile_every) if args.profile_dir else None)
+        if manifest is not None:
+            logger.info("Skipped {} up to date files".format(report.skipped))
+            if args.prune:
+                removed = manifest.prune()
+                logger.info("Removed {} masks of deleted files".format(len(removed)))
+    finally:
+        if manifest is not None:
+            manifest.close()
+    report_unknown_types(report.unknown_types)
+    if report.stats is not None:
+        stats_file = args.stats or os.path.join(args.output_dir, "stats.json")
+        report.stats.write(stats_file, report.seconds)
+        print("Stats: {} (see {})".format(report.stats.summary(report.seconds), stats_file), file=sys.stderr)
+    if report.class_counts is not None:
+        class_stats_file = os.path.join(args.output_dir, "class_stats.json")
+        class_counts = report.class_counts
+        if manifest is not None and not manifest.settings_changed and os.path.exists(class_stats_file):
+            # skipped pages keep their counts of the earlier runs, the pages of deleted files are dropped
+            with open(class_stats_file) as f:
+                class_counts = ClassCounts.from_dict(json.load(f)).updated(
+                    class_counts, pages={os.path.splitext(os.path.basename(file))[0] for file in manifest.entries})
+        elif manifest is not None and report.skipped:
+            logger.warning("No class stats of an earlier run, {} covers only the {} converted files".format(
+                class_stats_file, report.processed))
+        class_counts.write(class_stats_file, mask_gen.get_class_names())
+    if report.failures:
+        error_report = args.error_report or os.path.join(args.output_dir, "errors.json")
+        report.write_errors(error_report)
+        logger.error("{} of {} files could not be converted, see {}".format(len(report.failures), report.processed,
+                                                                           error_report))
+        return 1
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    # run the main of the package module, run as a script this module would exist twice and its classes would
+    # differ from the ones used by the driver and corpus modules
+    from pagexml_mask_converter.pagexml_to_mask import main as package_main
+    sys.exit(package_main())
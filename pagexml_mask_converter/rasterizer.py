@@ -0,0 +1,441 @@
+import enum
+from abc import ABC, abstractmethod
+from typing import NamedTuple, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+class DrawList(NamedTuple):
+    """
+    Shapes to draw, in drawing order, in pixel coordinates of the (scaled) page.
+
+    Shape i has the points coords[offsets[i]:offsets[i + 1]] and is drawn with the class id values[i].
+    A width of 0 fills the shape as a polygon, a width >= 1 draws it as a line of that width.
+    """
+    coords: np.ndarray
+    offsets: np.ndarray
+    values: np.ndarray
+    widths: np.ndarray
+
+    @property
+    def num_shapes(self) -> int:
+        return len(self.offsets) - 1
+
+    @staticmethod
+    def from_shapes(shapes, values, widths) -> 'DrawList':
+        shapes = [np.asarray(shape, dtype=np.int64).reshape(-1, 2) for shape in shapes]
+        counts = np.array([len(shape) for shape in shapes], dtype=np.int64)
+        offsets = np.zeros(len(shapes) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        coords = np.concatenate(shapes) if shapes else np.zeros((0, 2), dtype=np.int64)
+        return DrawList(coords=coords, offsets=offsets, values=np.asarray(values, dtype=np.uint8).reshape(-1),
+                        widths=np.asarray(widths, dtype=np.int64).reshape(-1))
+
+    @staticmethod
+    def gather(points: np.ndarray, starts: np.ndarray, counts: np.ndarray, values: np.ndarray,
+               widths: np.ndarray) -> 'DrawList':
+        """
+        Builds a draw list of shapes given as ranges points[starts[i]:starts[i] + counts[i]] of a point array.
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        indices, _ = _ranges(np.asarray(starts, dtype=np.int64), counts)
+        return DrawList(coords=points[indices], offsets=offsets, values=np.asarray(values, dtype=np.uint8),
+                        widths=np.asarray(widths, dtype=np.int64))
+
+
+class Rasterizer(ABC):
+    @abstractmethod
+    def render(self, draw_list: DrawList, page_size: Tuple[int, int],
+               window: Tuple[int, int, int, int]) -> Image:
+        """
+        Draws draw_list on a page of page_size (width, height) filled with class 0 and returns the
+        window (x, y, width, height) of it, which has to lie inside the page, as a "P" mode image.
+        """
+        pass
+
+    def render_rgb(self, draw_list: DrawList, page_size: Tuple[int, int], window: Tuple[int, int, int, int],
+                   palette) -> Image:
+        """
+        Like render, but returns an "RGB" image in which class id i has the color palette[i].
+        """
+        pil_image = self.render(draw_list, page_size, window)
+        pil_image.putpalette([channel for color in palette for channel in color])
+        return pil_image.convert('RGB')
+
+
+class PILRasterizer(Rasterizer):
+    """
+    Reference backend drawing every shape with ImageDraw.
+    """
+
+    def render(self, draw_list, page_size, window):
+        return self._draw(draw_list, page_size, window, 'P', list(range(256)))
+
+    def render_rgb(self, draw_list, page_size, window, palette):
+        # drawing the colors directly is faster than converting a "P" image
+        return self._draw(draw_list, page_size, window, 'RGB', [tuple(color) for color in palette])
+
+    @staticmethod
+    def _draw(draw_list, page_size, window, mode, colors):
+        width, height = page_size
+        window_x, window_y, window_width, window_height = window
+        # PIL's polygon filling adds fractional edge offsets to absolute x coordinates, which makes a
+        # horizontal shift change single pixels. The canvas therefore keeps the page's columns and only
+        # skips the rows above the window, vertical shifts are exact.
+        full_page = (window_width, window_height) == (width, height)
+        origin = np.array([0, window_y])
+        pil_image = Image.new(mode, (window_width if full_page else width, window_height), colors[0])
+        draw = ImageDraw.Draw(pil_image)
+        for shape, value, line_width in zip(np.split(draw_list.coords, draw_list.offsets[1:-1]),
+                                            draw_list.values.tolist(), draw_list.widths.tolist()):
+            if len(shape) < 2:
+                continue
+            points = (shape - origin).flatten().tolist()
+            color = colors[value]
+            if line_width == 0:
+                draw.polygon(points, outline=color, fill=color)
+            else:
+                draw.line(points, fill=color, width=line_width)
+        if not full_page:
+            pil_image = pil_image.crop((window_x, 0, window_x + window_width, window_height))
+        return pil_image
+
+
+# Rounding as done by PIL's ROUND_UP/ROUND_DOWN macros on floats (positive values are rounded in single
+# precision, negative ones in double precision)
+def _round_up_f32(x: np.ndarray) -> np.ndarray:
+    positive = np.floor(x + np.float32(0.5))
+    negative = -np.floor(np.abs(x.astype(np.float64)) + 0.5)
+    return np.where(x >= 0, positive, negative).astype(np.int64)
+
+
+def _round_down_f32(x: np.ndarray) -> np.ndarray:
+    positive = np.ceil(x - np.float32(0.5))
+    negative = -np.ceil(np.abs(x.astype(np.float64)) - 0.5)
+    return np.where(x >= 0, positive, negative).astype(np.int64)
+
+
+def _round_up(x: np.ndarray) -> np.ndarray:
+    return np.where(x >= 0, np.floor(x + 0.5), -np.floor(np.abs(x) + 0.5)).astype(np.int64)
+
+
+def _round_down(x: np.ndarray) -> np.ndarray:
+    return np.where(x >= 0, np.ceil(x - 0.5), -np.ceil(np.abs(x) - 0.5)).astype(np.int64)
+
+
+def _roundf(x: np.ndarray) -> np.ndarray:
+    x = x.astype(np.float64)
+    return (np.sign(x) * np.floor(np.abs(x) + 0.5)).astype(np.float32)
+
+
+def _edge_x(row, x0, y0, dx):
+    # float arithmetic of PIL's scanline intersection (row - y0) * dx + x0
+    return (row - y0).astype(np.float32) * dx + x0.astype(np.float32)
+
+
+def _group_starts(keys: np.ndarray) -> np.ndarray:
+    """
+    For a sorted key array, the index of the first element of the group of every element.
+    """
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    is_start = np.ones(len(keys), dtype=bool)
+    is_start[1:] = keys[1:] != keys[:-1]
+    return np.maximum.accumulate(np.where(is_start, np.arange(len(keys)), 0))
+
+
+def _ranges(starts: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Concatenated aranges starts[i] ... starts[i] + counts[i] - 1 and the index i of every element.
+    """
+    counts = np.maximum(counts, 0)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    first = np.cumsum(counts) - counts
+    return starts[owner] + np.arange(len(owner)) - first[owner], owner
+
+
+class _Spans:
+    def __init__(self):
+        self.parts = []
+
+    def add(self, orders, rows, x_starts, x_ends):
+        self.parts.append((orders, rows, x_starts, x_ends))
+
+    def get(self):
+        if not self.parts:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty, empty
+        return tuple(np.concatenate([part[i] for part in self.parts]).astype(np.int64) for i in range(4))
+
+
+class NumpyRasterizer(Rasterizer):
+    """
+    Scanline rasterizer filling polygons and drawing lines directly into a NumPy array.
+
+    The geometry of all shapes of a page is computed at once. It follows the integer and floating point
+    arithmetic of PIL's drawing code (polygon_generic, ImagingDrawWideLine and the Bresenham line), so the
+    masks equal the ones of PILRasterizer. Single precision rounding can differ on platforms whose C
+    compiler contracts multiply-adds (e.g. ARM), which may flip single pixels on polygon edges.
+    As all computations use page coordinates, windows are exact and only the window is allocated.
+    It is slower than PILRasterizer, the vectorized geometry costs more than PIL's C loops.
+    """
+
+    def render(self, draw_list, page_size, window):
+        width, height = page_size
+        self.page_width, self.page_height = width, height
+        self.window = window
+        spans = _Spans()
+        counts = np.diff(draw_list.offsets)
+        drawn = counts >= 2
+        polygons = drawn & (draw_list.widths == 0)
+        lines = drawn & (draw_list.widths > 0)
+
+        edges = []
+        if polygons.any():
+            edges.append(self._polygon_edges(draw_list, polygons))
+        if lines.any():
+            edges.append(self._line_edges(draw_list, lines, spans))
+        if edges:
+            self._fill(*(np.concatenate(parts) for parts in zip(*edges)), spans=spans)
+        canvas = self._paint(spans, draw_list.values)
+        # shares the canvas, PIL copies read only images before modifying them
+        return Image.frombuffer('P', (canvas.shape[1], canvas.shape[0]), canvas, 'raw', 'P', 0, 1)
+
+    @staticmethod
+    def _polygon_edges(draw_list, polygons):
+        shape_ids = np.flatnonzero(polygons)
+        starts, ends = draw_list.offsets[:-1][shape_ids], draw_list.offsets[1:][shape_ids]
+        # edges between consecutive points
+        first, owner = _ranges(starts, ends - starts - 1)
+        p0, p1 = draw_list.coords[first], draw_list.coords[first + 1]
+        # closing edge, if the polygon is not closed already
+        last, first_point = draw_list.coords[ends - 1], draw_list.coords[starts]
+        open_polygon = (last != first_point).any(axis=1)
+        polygon_ids = np.concatenate([owner, np.flatnonzero(open_polygon)])
+        p0 = np.concatenate([p0, last[open_polygon]])
+        p1 = np.concatenate([p1, first_point[open_polygon]])
+        # keep PIL's edge order within a polygon, the closing edge comes last
+        order = np.argsort(polygon_ids, kind='stable')
+        polygon_ids = polygon_ids[order]
+        return shape_ids[polygon_ids], shape_ids[polygon_ids], p0[order], p1[order]
+
+    def _line_edges(self, draw_list, lines, spans):
+        shape_ids = np.flatnonzero(lines)
+        starts, ends = draw_list.offsets[:-1][shape_ids], draw_list.offsets[1:][shape_ids]
+        first, owner = _ranges(starts, ends - starts - 1)
+        segment_shapes = shape_ids[owner]
+        p0, p1 = draw_list.coords[first], draw_list.coords[first + 1]
+        widths = draw_list.widths[segment_shapes]
+
+        thin = widths == 1
+        if thin.any():
+            self._bresenham(segment_shapes[thin], p0[thin], p1[thin], spans)
+            # the end point of a thin line is drawn separately
+            thin_shapes = shape_ids[draw_list.widths[shape_ids] == 1]
+            end_points = draw_list.coords[draw_list.offsets[1:][thin_shapes] - 1]
+            self._points(thin_shapes, end_points, spans)
+
+        wide = ~thin
+        segment_shapes, p0, p1, widths = segment_shapes[wide], p0[wide], p1[wide], widths[wide]
+        delta = p1 - p0
+        point = (delta == 0).all(axis=1)
+        self._points(segment_shapes[point], p0[point], spans)
+        segment_shapes, p0, p1, widths, delta = (a[~point] for a in (segment_shapes, p0, p1, widths, delta))
+
+        big_hypotenuse = np.hypot(delta[:, 0], delta[:, 1])
+        small_hypotenuse = (widths - 1) / 2.0
+        ratio_max = _round_up(small_hypotenuse) / big_hypotenuse
+        ratio_min = _round_down(small_hypotenuse) / big_hypotenuse
+        dxmin = _round_down(ratio_min * delta[:, 1])
+        dxmax = _round_down(ratio_max * delta[:, 1])
+        dymin = _round_down(ratio_min * delta[:, 0])
+        dymax = _round_down(ratio_max * delta[:, 0])
+        vertices = np.stack([
+            np.stack([p0[:, 0] - dxmin, p0[:, 1] + dymax], axis=1),
+            np.stack([p1[:, 0] - dxmin, p1[:, 1] + dymax], axis=1),
+            np.stack([p1[:, 0] + dxmax, p1[:, 1] - dymin], axis=1),
+            np.stack([p0[:, 0] + dxmax, p0[:, 1] - dymin], axis=1),
+        ], axis=1)
+        # every segment is a polygon of its own
+        segment_ids = np.repeat(np.arange(len(segment_shapes)) + draw_list.num_shapes, 4)
+        return (segment_ids, np.repeat(segment_shapes, 4), vertices.reshape(-1, 2),
+                np.roll(vertices, -1, axis=1).reshape(-1, 2))
+
+    def _points(self, orders, points, spans):
+        spans.add(orders, points[:, 1], points[:, 0], points[:, 0])
+
+    def _bresenham(self, orders, p0, p1, spans):
+        delta = p1 - p0
+        dx, dy = np.abs(delta[:, 0]), np.abs(delta[:, 1])
+        xs, ys = np.where(delta[:, 0] < 0, -1, 1), np.where(delta[:, 1] < 0, -1, 1)
+        steps = np.maximum(dx, dy)
+        i, owner = _ranges(np.zeros(len(steps), dtype=np.int64), steps)
+        dx, dy, xs, ys = dx[owner], dy[owner], xs[owner], ys[owner]
+        x_major = dx > dy
+        minor = np.where(x_major, (2 * i * dy + dx) // np.maximum(2 * dx, 1),
+                         (2 * i * dx + dy) // np.maximum(2 * dy, 1))
+        x = p0[owner, 0] + xs * np.where(x_major, i, minor)
+        y = p0[owner, 1] + ys * np.where(x_major, minor, i)
+        spans.add(orders[owner], y, x, x)
+
+    def _fill(self, polygon_ids, orders, p0, p1, spans):
+        """
+        Scanline filling of many polygons at once, following PIL's polygon_generic.
+        polygon_ids must be sorted, edges of a polygon in the order PIL would add them.
+        """
+        if len(polygon_ids) == 0:
+            return
+        x0, y0, x1, y1 = p0[:, 0], p0[:, 1], p1[:, 0], p1[:, 1]
+        edge_ymin, edge_ymax = np.minimum(y0, y1), np.maximum(y0, y1)
+
+        # vertical extent of every polygon, clipped like PIL does
+        group_start = np.flatnonzero(np.r_[True, polygon_ids[1:] != polygon_ids[:-1]])
+        poly_ymin = np.minimum(np.minimum.reduceat(edge_ymin, group_start), self.page_height - 1)
+        poly_ymax = np.maximum(np.maximum.reduceat(edge_ymax, group_start), 0)
+        poly_ymin, poly_ymax = np.maximum(poly_ymin, 0), np.minimum(poly_ymax, self.page_height)
+        edge_poly = np.repeat(np.arange(len(group_start)), np.diff(np.r_[group_start, len(polygon_ids)]))
+        edge_poly_ymin, edge_poly_ymax = poly_ymin[edge_poly], poly_ymax[edge_poly]
+
+        horizontal = edge_ymin == edge_ymax
+        spans.add(orders[horizontal], y0[horizontal], np.minimum(x0, x1)[horizontal],
+                  np.maximum(x0, x1)[horizontal])
+
+        e = np.flatnonzero(~horizontal)
+        x0, y0, x1, y1 = x0[e], y0[e], x1[e], y1[e]
+        edge_ymin, edge_ymax, edge_poly = edge_ymin[e], edge_ymax[e], edge_poly[e]
+        edge_poly_ymin, edge_poly_ymax, orders = edge_poly_ymin[e], edge_poly_ymax[e], orders[e]
+        dx = (x1 - x0).astype(np.float32) / (y1 - y0).astype(np.float32)
+
+        # intersections of every edge with the scanlines of the window
+        window_top, window_bottom = self.window[1], self.window[1] + self.window[3] - 1
+        row_start = np.maximum(np.maximum(edge_ymin, edge_poly_ymin), window_top)
+        row_end = np.minimum(np.minimum(edge_ymax, edge_poly_ymax), window_bottom)
+        rows, edge = _ranges(row_start, row_end - row_start + 1)
+        xs = _edge_x(rows, x0[edge], y0[edge], dx[edge])
+
+        duplicate = (rows == edge_ymax[edge]) & (rows < edge_poly_ymax[edge])
+        corner = ~duplicate & ((rows == edge_ymin[edge]) | (rows == edge_ymax[edge])) & (dx[edge] != 0)
+        if corner.any():
+            xs[corner] = self._connect_corners(np.flatnonzero(corner), rows, edge, xs, x0, y0, dx,
+                                               edge_ymin, edge_ymax, edge_poly)[0]
+
+        rows = np.concatenate([rows, rows[duplicate]])
+        edge = np.concatenate([edge, edge[duplicate]])
+        xs = np.concatenate([xs, xs[duplicate]])
+        # pair up the sorted intersections of every polygon and scanline
+        order = np.lexsort((xs, rows, edge_poly[edge]))
+        rows, edge, xs = rows[order], edge[order], xs[order]
+        key = edge_poly[edge].astype(np.int64) * (self.page_height + 2) + rows
+        position = np.arange(len(key)) - _group_starts(key)
+        left = np.flatnonzero((position % 2 == 0)[:-1] & (key[1:] == key[:-1]))
+        spans.add(orders[edge[left]], rows[left], _round_up_f32(xs[left]), _round_down_f32(xs[left + 1]))
+
+    @staticmethod
+    def _connect_corners(events, rows, edge, xs, x0, y0, dx, edge_ymin, edge_ymax, edge_poly):
+        """
+        PIL moves intersections at corners of two shallow edges ("Connect discontiguous corners" in
+        polygon_generic). The other edge is the first preceding edge of the polygon ending or starting in
+        the same row whose rounded intersection matches and that also covers the neighbouring row.
+        """
+        xs = xs.copy()
+        event_rows, event_edges = rows[events], edge[events]
+        # candidate edges: non vertical edges ending or starting in the event row
+        candidates = np.flatnonzero(dx != 0)
+        candidate_rows = np.concatenate([edge_ymin[candidates], edge_ymax[candidates]])
+        candidates = np.concatenate([candidates, candidates])
+        key_candidates = edge_poly[candidates].astype(np.int64), candidate_rows
+        order = np.lexsort((candidates, key_candidates[1], key_candidates[0]))
+        candidates = candidates[order]
+        candidate_poly, candidate_rows = key_candidates[0][order], key_candidates[1][order]
+
+        # all (event, candidate) pairs of the same polygon and row with a preceding candidate edge
+        event_poly = edge_poly[event_edges].astype(np.int64)
+        lo = np.searchsorted(_pack(candidate_poly, candidate_rows), _pack(event_poly, event_rows), 'left')
+        hi = np.searchsorted(_pack(candidate_poly, candidate_rows), _pack(event_poly, event_rows), 'right')
+        pair_candidates, pair_events = _ranges(lo, hi - lo)
+        others = candidates[pair_candidates]
+        current = event_edges[pair_events]
+        keep = others < current
+        pair_events, others, current = pair_events[keep], others[keep], current[keep]
+        row = event_rows[pair_events]
+        x = xs[events[pair_events]]
+
+        matches = _roundf(x) == _roundf(_edge_x(row, x0[others], y0[others], dx[others]))
+        offset = np.where(row == edge_ymax[current], -1, 1)
+        next_row = row + offset
+        covers = (next_row >= edge_ymin[others]) & (next_row <= edge_ymax[others])
+        chosen = matches & covers
+        pair_events, others, current, x, next_row = (a[chosen] for a in (pair_events, others, current, x,
+                                                                          next_row))
+        # the first matching candidate ends PIL's search
+        first = np.ones(len(pair_events), dtype=bool)
+        first[1:] = pair_events[1:] != pair_events[:-1]
+        pair_events, others, current, x, next_row = (a[first] for a in (pair_events, others, current, x,
+                                                                        next_row))
+
+        adjacent = _edge_x(next_row, x0[current], y0[current], dx[current])
+        adjacent_other = _edge_x(next_row, x0[others], y0[others], dx[others])
+        one = np.float32(1)
+        right = (x > adjacent + one) & (x > adjacent_other + one)
+        left = ~right & (x < adjacent - one) & (x < adjacent_other - one)
+        x = np.where(right, _roundf(np.maximum(adjacent, adjacent_other)) + one, x)
+        x = np.where(left, _roundf(np.minimum(adjacent, adjacent_other)) - one, x)
+        result = xs[events]
+        result[pair_events] = x
+        return result, pair_events
+
+    def _paint(self, spans, values):
+        window_x, window_y, window_width, window_height = self.window
+        orders, rows, x_starts, x_ends = spans.get()
+        # clip to the page (as PIL's hline does) and to the window
+        x_starts = np.maximum(x_starts, max(0, window_x))
+        x_ends = np.minimum(x_ends, min(self.page_width, window_x + window_width) - 1)
+        visible = (rows >= window_y) & (rows < window_y + window_height) & (rows < self.page_height) & \
+                  (x_starts <= x_ends)
+        orders, rows, x_starts, x_ends = (a[visible] for a in (orders, rows, x_starts, x_ends))
+        rows, x_starts, x_ends = rows - window_y, x_starts - window_x, x_ends - window_x
+
+        # the span ends cut the flattened canvas into pieces, each showing the last shape covering it. Only
+        # the pieces covered by every span are visited, not its pixels, and the canvas is written at once.
+        starts = rows * window_width + x_starts
+        ends = rows * window_width + x_ends + 1
+        bounds = np.sort(np.concatenate([[0, window_width * window_height], starts, ends]))
+        bounds = bounds[np.append(True, bounds[1:] != bounds[:-1])]
+        first = np.searchsorted(bounds, starts)
+        pieces, span = _ranges(first, np.searchsorted(bounds, ends) - first)
+        owner = np.full(len(bounds) - 1, -1, dtype=np.int64)
+        np.maximum.at(owner, pieces, orders[span])
+        # pieces without a shape (owner -1) are background
+        piece_values = np.append(values, 0).astype(np.uint8)[owner]
+        return np.repeat(piece_values, np.diff(bounds)).reshape(window_height, window_width)
+
+
+def _pack(high: np.ndarray, low: np.ndarray) -> np.ndarray:
+    return (high.astype(np.int64) << 32) + (low.astype(np.int64) + (1 << 31))
+
+
+class RasterizerBackend(enum.Enum):
+    PIL = 'pil'
+    NUMPY = 'numpy'
+
+    def get_rasterizer(self) -> Rasterizer:
+        return {
+            RasterizerBackend.PIL: PILRasterizer,
+            RasterizerBackend.NUMPY: NumpyRasterizer,
+        }[self]()
+
+
+def compare_rasterizers(draw_list: DrawList, page_size: Tuple[int, int], window: Tuple[int, int, int, int] = None,
+                        reference: RasterizerBackend = RasterizerBackend.PIL,
+                        candidate: RasterizerBackend = RasterizerBackend.NUMPY) -> int:
+    """
+    Conformance check of two backends, returns the number of pixels in which their renderings of draw_list differ.
+    """
+    if window is None:
+        window = (0, 0) + tuple(page_size)
+    expected = np.asarray(reference.get_rasterizer().render(draw_list, page_size, window))
+    actual = np.asarray(candidate.get_rasterizer().render(draw_list, page_size, window))
+    return int(np.count_nonzero(expected != actual))
@@ -0,0 +1,241 @@
+import glob
+import json
+import os
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+def runs(labels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Runs of a label map in column major order (as COCO RLE counts them): (values, lengths).
+    """
+    flat = np.asarray(labels).ravel(order='F')
+    if flat.size == 0:
+        return flat[:0], np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, flat[1:] != flat[:-1]])
+    lengths = np.diff(np.r_[starts, flat.size])
+    return flat[starts], lengths
+
+
+def binary_counts(values: np.ndarray, lengths: np.ndarray, class_id: int) -> np.ndarray:
+    """
+    COCO RLE counts of the mask labels == class_id from the runs of the label map: alternating lengths of
+    0 and 1 runs, starting with a (possibly empty) run of 0.
+    """
+    selected = values == class_id
+    if len(selected) == 0:
+        return np.zeros(0, dtype=np.int64)
+    # merge neighbouring runs that are both in or both out of the class
+    boundaries = np.flatnonzero(np.r_[True, selected[1:] != selected[:-1]])
+    counts = np.add.reduceat(lengths, boundaries)
+    if selected[0]:
+        counts = np.r_[0, counts]
+    return counts.astype(np.int64)
+
+
+def counts_to_string(counts: np.ndarray) -> str:
+    """
+    COCO's compressed string of RLE counts (rleToString of the COCO API), for all counts at once.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    # from the fourth count on, the difference to the count two places before is stored
+    x = counts.copy()
+    x[3:] -= counts[1:-2]
+    chars = []
+    active = np.ones(len(x), dtype=bool)
+    while active.any():
+        c = x & 0x1f
+        x = x >> 5
+        more = np.where(c & 0x10, x != -1, x != 0) & active
+        chars.append(np.where(active, np.where(more, c | 0x20, c) + 48, 0))
+        active = more
+    if not chars:
+        return ''
+    chars = np.stack(chars, axis=1)
+    return chars[chars > 0].astype(np.uint8).tobytes().decode('ascii')
+
+
+def string_to_counts(string: str) -> np.ndarray:
+    """
+    Inverse of counts_to_string (rleFrString of the COCO API), vectorized.
+    """
+    data = np.frombuffer(string.encode('ascii'), dtype=np.uint8).astype(np.int64) - 48
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.int64)
+    last = (data & 0x20) == 0
+    value_of_char = np.r_[0, np.cumsum(last)[:-1]]
+    value_starts = np.flatnonzero(np.r_[True, last[:-1]])
+    shift = 5 * (np.arange(len(data)) - value_starts[value_of_char])
+    x = np.add.reduceat((data & 0x1f) << shift, value_starts)
+    # sign extension of negative differences
+    last_chars = data[last]
+    negative = (last_chars & 0x10) != 0
+    x = np.where(negative, x | (-1 << (shift[last] + 5)), x)
+    counts = x.copy()
+    # undo the differences to the count two places before: counts[i] = x[i] + counts[i - 2] for i > 2
+    if len(counts) > 3:
+        counts[3::2] = np.cumsum(x[1::2])[1:]
+    if len(counts) > 4:
+        counts[4::2] = np.cumsum(x[2::2])[1:]
+    return counts
+
+
+def decode_counts(counts: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """
+    Binary (height, width) mask of RLE counts.
+    """
+    height, width = size
+    bits = np.zeros(len(counts), dtype=bool)
+    bits[1::2] = True
+    return np.repeat(bits, counts)[:height * width].reshape((width, height)).T
+
+
+def encode(labels: np.ndarray, palette: List[int] = None, background: int = 0) -> Dict:
+    """
+    COCO RLE of every class of a label map except the background:
+    {'size': [height, width], 'classes': {class id: {'size': .., 'counts': ..., 'color': ...}}}.
+    Every class entry is a valid COCO RLE object. The color is taken from the flat palette if given.
+    """
+    labels = np.asarray(labels)
+    height, width = labels.shape[:2]
+    values, lengths = runs(labels)
+    classes = {}
+    for class_id in np.unique(values).tolist():
+        if class_id == background:
+            continue
+        entry = {'size': [height, width],
+                 'counts': counts_to_string(binary_counts(values, lengths, class_id))}
+        if palette is not None:
+            entry['color'] = palette[3 * class_id:3 * class_id + 3]
+        classes[str(class_id)] = entry
+    return {'size': [height, width], 'classes': classes}
+
+
+def decode(rle: Dict, background: int = 0, dtype=np.uint8) -> np.ndarray:
+    """
+    Label map of the output of encode. The runs of all classes are merged and expanded at once.
+    """
+    height, width = rle['size']
+    starts, lengths, values = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], []
+    for class_id, entry in rle['classes'].items():
+        counts = string_to_counts(entry['counts'])
+        ends = np.cumsum(counts)
+        # the runs of the class are the odd counts
+        starts.append(ends[:-1][::2])
+        lengths.append(counts[1::2])
+        values.append(np.full(len(lengths[-1]), int(class_id), dtype=dtype))
+    starts, lengths = np.concatenate(starts), np.concatenate(lengths)
+    values = np.concatenate(values) if values else np.zeros(0, dtype=dtype)
+    order = np.argsort(starts, kind='stable')
+    starts, lengths, values = starts[order], lengths[order], values[order]
+    # every run of a class is followed by the background up to the next run or the end
+    gaps = np.r_[starts[1:], height * width] - (starts + lengths)
+    first = starts[0] if len(starts) else height * width
+    run_values = np.r_[background, np.stack([values, np.full(len(values), background)], axis=1).ravel()]
+    run_lengths = np.r_[first, np.stack([lengths, gaps], axis=1).ravel()]
+    labels = np.repeat(run_values.astype(dtype), run_lengths)
+    return np.ascontiguousarray(labels.reshape((width, height)).T)
+
+
+def to_rgb(rle: Dict, background_color=(255, 255, 255)) -> np.ndarray:
+    """
+    RGB mask of the output of encode, drawn with the colors stored with the classes.
+    """
+    labels = decode(rle)
+    lookup = np.tile(np.array(background_color, dtype=np.uint8), (256, 1))
+    for class_id, entry in rle['classes'].items():
+        if 'color' in entry:
+            lookup[int(class_id)] = entry['color']
+    return lookup[labels]
+
+
+class RLEMaskWriter:
+    """
+    Appends the COCO RLE of label map masks to json lines shard files rle-<id>-<n>.jsonl of a directory,
+    one line {'name': ..., 'size': ..., 'classes': ...} per mask. Like PackedMaskWriter, every process
+    writes its own shards.
+    """
+    # masks are rendered as class ids for this writer
+    label_map = True
+
+    def __init__(self, directory: str, shard_size: int = 1 << 30, writer_id: str = None):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.writer_id = writer_id if writer_id is not None else '{}-{}'.format(os.getpid(), time.time_ns())
+        self._shard = -1
+        self._file = None
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def shard_path(self) -> str:
+        return os.path.join(self.directory, 'rle-{}-{}.jsonl'.format(self.writer_id, self._shard))
+
+    def add(self, name: str, mask) -> str:
+        """
+        Appends the RLE of mask, a label map array or "P" image whose palette gives the class colors.
+        Returns "<shard path>#<name>", like PackedMaskWriter.add.
+        """
+        palette = mask.getpalette() if isinstance(mask, Image.Image) else None
+        line = json.dumps({'name': name, **encode(np.asarray(mask), palette=palette)}) + '\n'
+        if self._file is None or (self._file.tell() > 0 and self._file.tell() + len(line) > self.shard_size):
+            self.close()
+            self._shard += 1
+            self._file = open(self.shard_path, 'w')
+        self._file.write(line)
+        self._file.flush()
+        return '{}#{}'.format(self.shard_path, name)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RLEMasks:
+    """
+    Reads the masks written by RLEMaskWriter, by name. Only the line positions are kept in memory,
+    masks[name] reads and decodes the line of name to a label map, get_rle returns the RLE itself.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.entries: Dict[str, Tuple[str, int]] = {}
+        for shard in sorted(glob.glob(os.path.join(directory, 'rle-*.jsonl'))):
+            with open(shard, 'rb') as f:
+                position = 0
+                for line in f:
+                    try:
+                        name = json.loads(line)['name']
+                    except ValueError:
+                        # the last line of an interrupted run may be incomplete
+                        continue
+                    finally:
+                        start, position = position, position + len(line)
+                    self.entries[name] = (shard, start)
+
+    def names(self) -> List[str]:
+        return list(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def get_rle(self, name: str) -> Dict:
+        shard, position = self.entries[name]
+        with open(shard, 'rb') as f:
+            f.seek(position)
+            return json.loads(f.readline())
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return decode(self.get_rle(name))
@@ -0,0 +1,350 @@
+import asyncio
+import http.client
+import io
+import json
+import logging
+import os
+import socket
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Union
+from urllib.parse import parse_qs, quote, unquote, urlencode, urlsplit
+
+import numpy as np
+
+from pagexml_mask_converter.corpus import CompiledCorpus
+from pagexml_mask_converter.pagexml_to_mask import CompactPageRegions, MaskGenerator, MaskType, parse_page_xml
+
+logger = logging.getLogger(__name__)
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            500: 'Internal Server Error'}
+_CONTENT_TYPES = {'npy': 'application/x-npy', 'png': 'image/png'}
+
+
+class PageNotFound(KeyError):
+    """
+    No page with the requested id is served, answered with 404.
+    """
+    pass
+
+
+class LRUCache:
+    """
+    Least recently used cache holding at most max_items entries and max_bytes bytes (by the size function).
+    """
+
+    def __init__(self, max_items: int = None, max_bytes: int = None, size: Callable = len):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.size = size
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, count_miss: bool = True):
+        """
+        With count_miss False, a missing key is not counted, the caller counts it if it has to compute the value.
+        """
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += count_miss
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if key in self._entries:
+            self.bytes -= self.size(self._entries.pop(key))
+        self._entries[key] = value
+        self.bytes += self.size(value)
+        while self._entries and ((self.max_items is not None and len(self._entries) > self.max_items) or
+                                 (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= self.size(evicted)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def to_dict(self):
+        requests = self.hits + self.misses
+        return {'items': len(self), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hits / requests if requests else 0.0}
+
+
+def _page_bytes(page: CompactPageRegions) -> int:
+    return sum(field.nbytes for field in page if isinstance(field, np.ndarray))
+
+
+def page_ids(files: Iterable[str]) -> Dict[str, str]:
+    """
+    Ids of files to serve: the file name without extension. Of files with the same name the first one is served.
+    """
+    ids = {}
+    for file in files:
+        page_id = os.path.splitext(os.path.basename(file))[0]
+        if page_id in ids:
+            logger.warning("Page id {} of {} is already used by {}, skipping".format(page_id, file, ids[page_id]))
+            continue
+        ids[page_id] = file
+    return ids
+
+
+class MaskServer:
+    """
+    Serves masks over HTTP on a TCP port or a Unix socket, keeping a MaskGenerator warm for many clients.
+
+    Pages are either PageXML files or the pages of a CompiledCorpus, identified by their file name without
+    extension. Parsed pages and encoded masks are kept in LRU caches, so a mask requested again is sent
+    without parsing or rendering. Parsing and rendering run on a thread pool, requests for the same page or
+    mask that arrive while it is being prepared wait for the same result. Endpoints:
+
+        GET /mask/<page id>?type=<mask type>&scale=<scale>&label_map=<0|1>&format=<npy|png>
+        GET /pages
+        GET /stats
+
+    type defaults to the mask type of the generator's settings, scale to 1, label_map to the settings and
+    format to npy. Errors are answered with a json {"error": ...}. See MaskClient.
+    """
+
+    def __init__(self, mask_generator: MaskGenerator, files: Iterable[str] = (), corpus: CompiledCorpus = None,
+                 cache_bytes: int = 1 << 30, page_cache_size: int = 256, threads: int = 4):
+        self.mask_generator = mask_generator
+        self.corpus = corpus
+        if corpus is not None:
+            self.sources: Dict[str, Union[str, int]] = {
+                page_id: corpus.index_of(source) for page_id, source in page_ids(corpus.sources).items()}
+        else:
+            self.sources = page_ids(files)
+        self.pages = LRUCache(max_items=page_cache_size, size=_page_bytes)
+        self.masks = LRUCache(max_bytes=cache_bytes)
+        self.requests = 0
+        self.unknown_types = Counter()
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='mask-server')
+        self._pending: Dict[tuple, asyncio.Future] = {}
+
+    async def _cached(self, cache: LRUCache, key: tuple, compute: Callable):
+        value = cache.get(key, count_miss=False)
+        if value is not None:
+            return value
+        # only the request starting the computation is a miss, the ones waiting for it are served as hits
+        if key in self._pending:
+            cache.hits += 1
+            return await asyncio.shield(self._pending[key])
+        cache.misses += 1
+        future = asyncio.get_running_loop().run_in_executor(self._executor, compute)
+        self._pending[key] = future
+        try:
+            value = await future
+        finally:
+            del self._pending[key]
+        cache.put(key, value)
+        return value
+
+    def _load(self, page_id: str) -> CompactPageRegions:
+        source = self.sources[page_id]
+        if self.corpus is not None:
+            return self.corpus[source]
+        # every kind of polygon, so that every mask type is rendered from one parse
+        return parse_page_xml(source, list(MaskType))
+
+    async def get_page(self, page_id: str) -> CompactPageRegions:
+        if page_id not in self.sources:
+            raise PageNotFound(page_id)
+        return await self._cached(self.pages, ('page', page_id), lambda: self._load(page_id))
+
+    async def get_mask(self, page_id: str, mask_type: MaskType, scale: float = 1.0, label_map: bool = None,
+                       image_format: str = 'npy') -> bytes:
+        """
+        The encoded mask of a page, as .npy or png bytes.
+        """
+        page = await self.get_page(page_id)
+
+        def render():
+            mask = self.mask_generator.render(page, mask_type, scale, label_map=label_map)
+            data = io.BytesIO()
+            if image_format == 'png':
+                mask.save(data, format='png')
+            else:
+                np.save(data, np.asarray(mask), allow_pickle=False)
+            return data.getvalue()
+
+        return await self._cached(self.masks, ('mask', page_id, mask_type, scale, label_map, image_format), render)
+
+    def get_stats(self) -> Dict:
+        self.unknown_types.update(self.mask_generator.pop_unknown_types())
+        return {'pages': len(self.sources), 'requests': self.requests, 'page_cache': self.pages.to_dict(),
+                'mask_cache': self.masks.to_dict(),
+                'unknown_types': {'{} in {}'.format(r_type, region): count for (region, r_type), count in
+                                  self.unknown_types.items()}}
+
+    async def respond(self, path: str):
+        """
+        Status, content type and body of the answer to a GET of path.
+        """
+        url = urlsplit(path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == '/pages':
+            return 200, 'application/json', json.dumps(list(self.sources)).encode('utf-8')
+        if url.path == '/stats':
+            return 200, 'application/json', json.dumps(self.get_stats()).encode('utf-8')
+        if not url.path.startswith('/mask/'):
+            return 404, 'application/json', json.dumps({'error': 'Not found: {}'.format(url.path)}).encode('utf-8')
+        page_id = unquote(url.path[len('/mask/'):])
+        try:
+            mask_type = MaskType(query['type']) if 'type' in query else self.mask_generator.settings.MASK_TYPE
+            scale = float(query.get('scale', 1.0))
+            label_map = query['label_map'] in ('1', 'true') if 'label_map' in query else None
+            image_format = query.get('format', 'npy')
+            if image_format not in _CONTENT_TYPES or not scale > 0:
+                raise ValueError("Invalid format or scale")
+        except ValueError as e:
+            return 400, 'application/json', json.dumps({'error': str(e)}).encode('utf-8')
+        body = await self.get_mask(page_id, mask_type, scale, label_map, image_format)
+        return 200, _CONTENT_TYPES[image_format], body
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Answers the requests of a connection, which is kept open for further requests unless the client
+        closes it or asks to.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                parts = request_line.decode('latin1').split()
+                if len(parts) != 3:
+                    break
+                method, path, version = parts
+                self.requests += 1
+                if method != 'GET':
+                    status, content_type, body = 405, 'application/json', b'{"error": "Only GET is supported"}'
+                else:
+                    try:
+                        status, content_type, body = await self.respond(path)
+                    except PageNotFound as e:
+                        status, content_type = 404, 'application/json'
+                        body = json.dumps({'error': 'Not found: {}'.format(e.args[0])}).encode('utf-8')
+                    except Exception as e:
+                        logger.exception("Failed to answer {}".format(path))
+                        status, content_type = 500, 'application/json'
+                        body = json.dumps({'error': '{}: {}'.format(type(e).__name__, e)}).encode('utf-8')
+                close = headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0'
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'
+                             .format(status, _REASONS[status], content_type, len(body),
+                                     'close' if close else 'keep-alive').encode('latin1') + body)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8765, socket_path: str = None) -> asyncio.AbstractServer:
+        if socket_path is not None:
+            return await asyncio.start_unix_server(self.handle, path=socket_path)
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8765, socket_path: str = None):
+        server = await self.start(host, port, socket_path)
+        address = socket_path or '{}:{}'.format(*server.sockets[0].getsockname()[:2])
+        logger.info("Serving masks of {} pages on {}".format(len(self.sources), address))
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host: str = '127.0.0.1', port: int = 8765, socket_path: str = None):
+        try:
+            asyncio.run(self.serve(host, port, socket_path))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._executor.shutdown(wait=False)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class MaskClient:
+    """
+    Client of a MaskServer, keeping one connection open::
+
+        with MaskClient(port=8765) as client:
+            mask = client.get_mask('page_0001', MaskType.BASE_LINE, scale=0.5)
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8765, socket_path: str = None, timeout: float = 60):
+        if socket_path is not None:
+            self._connection = _UnixHTTPConnection(socket_path, timeout=timeout)
+        else:
+            self._connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _get(self, path: str) -> bytes:
+        self._connection.request('GET', path)
+        response = self._connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            try:
+                message = json.loads(body)['error']
+            except ValueError:
+                message = body.decode('utf-8', 'replace')
+            raise (PageNotFound if response.status == 404 else RuntimeError)(message)
+        return body
+
+    def _get_mask(self, page_id: str, mask_type: MaskType, scale: float, label_map: bool,
+                  image_format: str) -> bytes:
+        query = {'scale': scale, 'format': image_format}
+        if mask_type is not None:
+            query['type'] = MaskType(mask_type).value
+        if label_map is not None:
+            query['label_map'] = int(label_map)
+        return self._get('/mask/{}?{}'.format(quote(page_id, safe=''), urlencode(query)))
+
+    def get_mask(self, page_id: str, mask_type: MaskType = None, scale: float = 1.0,
+                 label_map: bool = None) -> np.ndarray:
+        """
+        Mask of a page as array, mask_type and label_map default to the settings of the server.
+        """
+        body = self._get_mask(page_id, mask_type, scale, label_map, 'npy')
+        return np.load(io.BytesIO(body), allow_pickle=False)
+
+    def get_png(self, page_id: str, mask_type: MaskType = None, scale: float = 1.0, label_map: bool = None) -> bytes:
+        """
+        Mask of a page as png file content.
+        """
+        return self._get_mask(page_id, mask_type, scale, label_map, 'png')
+
+    def pages(self) -> List[str]:
+        return json.loads(self._get('/pages'))
+
+    def stats(self) -> Dict:
+        return json.loads(self._get('/stats'))
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,95 @@
+from typing import Tuple
+
+import numpy as np
+
+from pagexml_mask_converter.rasterizer import _ranges
+
+
+def _douglas_peucker(points: np.ndarray, starts: np.ndarray, ends: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Points kept by Douglas-Peucker between every pair of starts[i] and ends[i]. All segments of all polygons
+    are split in the same step, so the number of steps is the depth of the recursion, not the number of points.
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[starts] = True
+    keep[ends] = True
+    xs, ys = points[:, 0].astype(np.float64), points[:, 1].astype(np.float64)
+    while len(starts):
+        inner = ends - starts - 1
+        starts, ends, inner = starts[inner > 0], ends[inner > 0], inner[inner > 0]
+        if not len(starts):
+            break
+        indices, segment = _ranges(starts + 1, inner)
+        ax, ay = xs[starts], ys[starts]
+        dx, dy = xs[ends] - ax, ys[ends] - ay
+        length = np.hypot(dx, dy)
+        degenerate = length == 0
+        # distance to the line through start and end, or to start if they are equal
+        ox, oy = xs[indices] - ax[segment], ys[indices] - ay[segment]
+        distance = np.abs(dx[segment] * oy - dy[segment] * ox) / np.where(degenerate, 1.0, length)[segment]
+        if degenerate.any():
+            on_point = degenerate[segment]
+            distance[on_point] = np.hypot(ox[on_point], oy[on_point])
+        first = np.cumsum(inner) - inner
+        farthest = np.maximum.reduceat(distance, first)
+        # first point of every segment with the largest distance
+        candidates = np.flatnonzero(distance == farthest[segment])
+        candidates = candidates[np.r_[True, segment[candidates[1:]] != segment[candidates[:-1]]]]
+        split = farthest > tolerance
+        middles = indices[candidates][split]
+        keep[middles] = True
+        starts, ends = np.concatenate([starts[split], middles]), np.concatenate([middles, ends[split]])
+    return keep
+
+
+def simplify_polygons(coords: np.ndarray, offsets: np.ndarray, tolerance: float = 0.0,
+                      lines: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Removes vertices that do not change the shape of the polygons (or polylines) of a page in pixel coordinates:
+    vertices equal to the one before and vertices on a horizontal or vertical straight line between their
+    neighbours, which leaves the masks unchanged. With a tolerance > 0, vertices on any straight line are
+    removed as well and Douglas-Peucker removes vertices closer than tolerance pixels to the simplified line.
+    Rasterizers intersect diagonal edges in floating point, so this can move single pixels on the edges.
+    With lines, the polygons are drawn as lines, whose vertices equal to the one before are kept unless
+    tolerance > 0: a wide line draws its zero length segments as well.
+    The first and last vertex of every polygon are kept, so baselines keep their ends and no polygon vanishes.
+
+    coords holds the points of all polygons, polygon i is coords[offsets[i]:offsets[i + 1]].
+    Returns the mask of the kept points and the offsets of the polygons made of them.
+    """
+    coords = np.asarray(coords)
+    counts = np.diff(offsets)
+    first = np.zeros(len(coords), dtype=bool)
+    last = np.zeros(len(coords), dtype=bool)
+    first[offsets[:-1][counts > 0]] = True
+    last[offsets[1:][counts > 0] - 1] = True
+
+    keep = np.ones(len(coords), dtype=bool)
+    if len(coords) > 1 and (tolerance > 0 or not lines):
+        keep[1:] = ~(coords[1:] == coords[:-1]).all(axis=1) | first[1:]
+    keep |= last
+
+    # collinear vertices, among the points left, are compared with their neighbours left
+    kept = np.flatnonzero(keep)
+    if len(kept) > 2:
+        points = coords[kept].astype(np.int64)
+        before, after = points[1:-1] - points[:-2], points[2:] - points[1:-1]
+        cross = before[:, 0] * after[:, 1] - before[:, 1] * after[:, 0]
+        dot = (before * after).sum(axis=1)
+        # only vertices continuing in the same direction, turning back would shorten the polygon
+        removable = ~first[kept[1:-1]] & ~last[kept[1:-1]] & (cross == 0) & (dot > 0)
+        if tolerance <= 0:
+            # splitting a diagonal edge changes where it is intersected with the rows
+            removable &= (before == 0).any(axis=1)
+        keep[kept[1:-1][removable]] = False
+
+    if tolerance > 0:
+        kept = np.flatnonzero(keep)
+        kept_first, kept_last = np.flatnonzero(first[kept]), np.flatnonzero(last[kept])
+        dp_keep = _douglas_peucker(coords[kept], kept_first, kept_last, tolerance)
+        keep[kept[~dp_keep]] = False
+
+    owner = np.repeat(np.arange(len(counts)), counts)
+    new_offsets = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(np.bincount(owner[keep], minlength=len(counts)), out=new_offsets[1:])
+    return keep, new_offsets
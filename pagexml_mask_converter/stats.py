@@ -0,0 +1,251 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Set
+
+import numpy as np
+
+# stages of a conversion, in the order they happen
+STAGES = ('parse', 'simplify', 'classes', 'draw', 'encode', 'write')
+
+
+class RunStats:
+    """
+    Statistics of a conversion: seconds spent per stage, counters of pages, regions, points and masks,
+    unknown types, the largest canvas drawn and the busy time of every worker process.
+    Stats of worker processes are merged into the stats of the run. Timers may be used from several threads,
+    so the seconds of a stage are summed over threads and processes and can exceed the wall time.
+    """
+
+    def __init__(self):
+        self.timers: Dict[str, float] = Counter()
+        self.counters: Dict[str, int] = Counter()
+        self.unknown_types: Counter = Counter()
+        self.peak_canvas = (0, 0)
+        self.workers: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, stage: str, seconds: float):
+        with self._lock:
+            self.timers[stage] += seconds
+
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def count(self, **counts: int):
+        with self._lock:
+            self.counters.update(counts)
+
+    def canvas(self, width: int, height: int):
+        if width * height > self.peak_canvas[0] * self.peak_canvas[1]:
+            self.peak_canvas = (int(width), int(height))
+
+    def worker(self, seconds: float, files: int = 1, worker: str = None):
+        """
+        Adds busy time of a worker process, by default of this one.
+        """
+        worker = worker if worker is not None else str(os.getpid())
+        entry = self.workers.setdefault(worker, {'files': 0, 'busy_seconds': 0.0})
+        entry['files'] += files
+        entry['busy_seconds'] += seconds
+
+    def merge(self, other: 'RunStats') -> 'RunStats':
+        with self._lock:
+            self.timers.update(other.timers)
+            self.counters.update(other.counters)
+        self.unknown_types.update(other.unknown_types)
+        self.canvas(*other.peak_canvas)
+        for worker, entry in other.workers.items():
+            self.worker(entry['busy_seconds'], entry['files'], worker)
+        return self
+
+    def to_dict(self, wall_seconds: float = None) -> Dict:
+        workers = {}
+        for worker, entry in self.workers.items():
+            workers[worker] = dict(entry)
+            if wall_seconds:
+                workers[worker]['utilisation'] = entry['busy_seconds'] / wall_seconds
+        return {
+            'wall_seconds': wall_seconds,
+            'stages': {stage: self.timers[stage] for stage in sorted(self.timers, key=_stage_order)},
+            'counters': dict(self.counters),
+            'unknown_types': {'{} in {}'.format(r_type, region): count
+                              for (region, r_type), count in self.unknown_types.items()},
+            'peak_canvas': {'width': self.peak_canvas[0], 'height': self.peak_canvas[1]},
+            'workers': workers,
+        }
+
+    def summary(self, wall_seconds: float = None) -> str:
+        """
+        One line with the share of every stage in the measured time, and the throughput.
+        """
+        total = sum(self.timers.values()) or 1.0
+        stages = ', '.join('{} {:.0%}'.format(stage, self.timers[stage] / total)
+                           for stage in sorted(self.timers, key=_stage_order))
+        pages = self.counters['pages']
+        rate = ', {:.1f} pages/s'.format(pages / wall_seconds) if wall_seconds else ''
+        return '{} pages, {} regions, {} points, {} masks{}; {}'.format(
+            pages, self.counters['regions'], self.counters['points'], self.counters['masks'], rate, stages)
+
+    def write(self, path: str, wall_seconds: float = None):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(wall_seconds), f, indent=4)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+def _stage_order(stage: str):
+    return (STAGES.index(stage), stage) if stage in STAGES else (len(STAGES), stage)
+
+
+class SampledProfiler:
+    """
+    Runs every n-th page under cProfile and dumps its profile to directory as <pid>-<page number>.prof,
+    to be read with pstats or snakeviz. Every process counts its own pages.
+    """
+
+    def __init__(self, directory: str, every: int = 100):
+        self.directory = directory
+        self.every = max(every, 1)
+        self._pages = 0
+
+    @contextmanager
+    def sample(self, name: str = None):
+        self._pages += 1
+        if (self._pages - 1) % self.every:
+            yield None
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield profile
+        finally:
+            profile.disable()
+            suffix = '-' + os.path.basename(name) if name is not None else ''
+            profile.dump_stats(os.path.join(self.directory, '{}-{}{}.prof'.format(os.getpid(), self._pages, suffix)))
+
+
+def timed(stats: RunStats, stage: str):
+    """
+    stats.time(stage), or a context that measures nothing if stats is None.
+    """
+    return stats.time(stage) if stats is not None else nullcontext()
+
+
+class ClassCounts:
+    """
+    Pixels per class id of the rendered masks, in total and per page, kept apart by mask type and scale.
+    Counts of worker processes are merged into the counts of the run.
+
+    Besides the pixel frequency of every class, to_dict gives the median frequency balancing weights
+    (Eigen and Fergus): the frequency of a class is taken over the pixels of the pages it occurs on, and
+    its weight is the median of these frequencies divided by its frequency.
+    """
+
+    def __init__(self):
+        self.pixels: Dict[str, np.ndarray] = {}
+        # pixels of the pages a class occurs on, per class
+        self.present_pixels: Dict[str, np.ndarray] = {}
+        self.pages: Dict[str, Dict[str, Dict[int, int]]] = {}
+
+    @staticmethod
+    def _add(totals: Dict[str, np.ndarray], key: str, counts: np.ndarray):
+        total = totals.get(key)
+        if total is None or len(total) < len(counts):
+            grown = np.zeros(len(counts), dtype=np.int64)
+            if total is not None:
+                grown[:len(total)] = total
+            totals[key] = total = grown
+        total[:len(counts)] += counts
+
+    def add(self, key: str, page: str, labels: np.ndarray, num_classes: int = 0):
+        """
+        Counts the class ids of the label map of page.
+        """
+        counts = np.bincount(np.asarray(labels).ravel(), minlength=num_classes).astype(np.int64)
+        self.add_counts(key, page, counts)
+
+    def add_counts(self, key: str, page: str, counts: np.ndarray):
+        self._add(self.pixels, key, counts)
+        self._add(self.present_pixels, key, np.where(counts > 0, counts.sum(), 0))
+        present = np.flatnonzero(counts)
+        self.pages.setdefault(key, {})[page] = dict(zip(present.tolist(), counts[present].tolist()))
+
+    def merge(self, other: 'ClassCounts') -> 'ClassCounts':
+        for key, counts in other.pixels.items():
+            self._add(self.pixels, key, counts)
+            self._add(self.present_pixels, key, other.present_pixels[key])
+            self.pages.setdefault(key, {}).update(other.pages.get(key, {}))
+        return self
+
+    def updated(self, other: 'ClassCounts', pages: Set[str] = None) -> 'ClassCounts':
+        """
+        Counts of the pages of self and other, where the counts of a page in other replace its counts in self,
+        e.g. the counts of an earlier run updated with the pages converted again. With pages, only the pages
+        named in it are kept.
+        """
+        result = ClassCounts()
+        for key in list(self.pages) + [key for key in other.pages if key not in self.pages]:
+            for page, classes in {**self.pages.get(key, {}), **other.pages.get(key, {})}.items():
+                if pages is None or page in pages:
+                    counts = np.zeros(max(classes, default=-1) + 1, dtype=np.int64)
+                    counts[list(classes)] = list(classes.values())
+                    result.add_counts(key, page, counts)
+        return result
+
+    @staticmethod
+    def from_dict(data: Dict) -> 'ClassCounts':
+        """
+        Counts of the per_page entries of to_dict, e.g. read back from the class_stats.json of an earlier run.
+        """
+        counts = ClassCounts()
+        for key, entry in data.items():
+            counts.pages[key] = {page: {int(class_id): n for class_id, n in classes.items()}
+                                 for page, classes in entry.get('per_page', {}).items()}
+        return counts.updated(ClassCounts())
+
+    def to_dict(self, class_names: Dict[str, Dict[int, List[str]]] = None, per_page: bool = True) -> Dict:
+        """
+        :param class_names: optional names of the class ids per key, see ColorTable.class_names
+        """
+        result = {}
+        for key, pixels in self.pixels.items():
+            present = self.present_pixels[key]
+            occurring = np.flatnonzero(pixels)
+            frequency = pixels[occurring] / present[occurring]
+            weights = np.median(frequency) / frequency
+            names = (class_names or {}).get(key, {})
+            result[key] = {
+                'pixels': int(pixels.sum()),
+                'pages': len(self.pages.get(key, {})),
+                'classes': {str(class_id): {'names': names.get(class_id, []),
+                                            'pixels': int(pixels[class_id]),
+                                            'frequency': float(pixels[class_id] / pixels.sum()),
+                                            'median_frequency_weight': float(weight)}
+                            for class_id, weight in zip(occurring.tolist(), weights)},
+            }
+            if per_page:
+                result[key]['per_page'] = {page: {str(c): n for c, n in counts.items()}
+                                           for page, counts in self.pages.get(key, {}).items()}
+        return result
+
+    def write(self, path: str, class_names: Dict[str, Dict[int, List[str]]] = None, per_page: bool = True):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(class_names, per_page=per_page), f, indent=4)
@@ -0,0 +1,122 @@
+import os
+from dataclasses import dataclass
+from typing import List, Sequence
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+from pagexml_mask_converter.data import GraphicRegionPageXMLTypes, TextPageXMLTypes
+from pagexml_mask_converter.pagexml_to_mask import PCGTSVersion
+
+# regions of a synthetic page, in this order, most of them text
+_REGIONS = ['TextRegion', 'TextRegion', 'ImageRegion', 'TextRegion', 'GraphicRegion', 'TextRegion',
+            'SeparatorRegion', 'TextRegion', 'TableRegion', 'TextRegion']
+
+
+@dataclass
+class SyntheticPageConfig:
+    """
+    Shape of a synthetic page: size in pixels, number of regions, TextLines per TextRegion and vertices of
+    every region and line polygon (and of every baseline, half of them).
+    With words, every TextLine has Words, Glyphs and TextEquivs, which the parser has to skip.
+    """
+    width: int = 2480
+    height: int = 3508
+    regions: int = 20
+    lines: int = 10
+    vertices: int = 16
+    words: bool = True
+
+
+def _points(xs, ys) -> str:
+    return ' '.join('{},{}'.format(x, y) for x, y in zip(np.round(xs).astype(int), np.round(ys).astype(int)))
+
+
+def _ellipse(rng, x0, y0, x1, y1, vertices) -> str:
+    vertices = max(vertices, 3)
+    angles = (np.arange(vertices) + rng.uniform(-0.3, 0.3, vertices)) * (2 * np.pi / vertices)
+    cx, cy, rx, ry = (x0 + x1) / 2, (y0 + y1) / 2, (x1 - x0) / 2, (y1 - y0) / 2
+    return _points(cx + rx * np.cos(angles), cy + ry * np.sin(angles))
+
+
+def _line_elements(rng, x0, y0, x1, y1, config: SyntheticPageConfig, index: int) -> List[str]:
+    count = max(config.vertices // 2, 2)
+    xs = np.linspace(x0, x1, count)
+    height = y1 - y0
+    top = y0 + rng.uniform(0, 0.1 * height, count)
+    bottom = y1 - rng.uniform(0, 0.1 * height, count)
+    baseline = y1 - 0.2 * height + rng.uniform(-0.05 * height, 0.05 * height, count)
+    elements = ['<TextLine id="l{}">'.format(index),
+                '<Coords points="{}"/>'.format(_points(np.r_[xs, xs[::-1]], np.r_[top, bottom[::-1]])),
+                '<Baseline points="{}"/>'.format(_points(xs, baseline))]
+    if config.words:
+        for word, (wx0, wx1) in enumerate(zip(xs[:-1], xs[1:])):
+            box = _points([wx0, wx1, wx1, wx0], [y0, y0, y1, y1])
+            elements.append('<Word id="l{0}_w{1}"><Coords points="{2}"/><Glyph id="l{0}_w{1}_g"><Coords points="{2}"/>'
+                            '<TextEquiv><Unicode>a</Unicode></TextEquiv></Glyph>'
+                            '<TextEquiv><Unicode>word</Unicode></TextEquiv></Word>'.format(index, word, box))
+        elements.append('<TextEquiv><Unicode>text of line {}</Unicode></TextEquiv>'.format(index))
+    elements.append('</TextLine>')
+    return elements
+
+
+def generate_page(config: SyntheticPageConfig = None, version: PCGTSVersion = PCGTSVersion.PCGTS2017,
+                  image_filename: str = 'page.png', seed: int = 0) -> str:
+    """
+    PageXML of a synthetic page in the namespace of version. Regions are laid out on a grid, text regions
+    are filled with TextLines. The same seed gives the same page.
+    """
+    config = config if config is not None else SyntheticPageConfig()
+    rng = np.random.default_rng(seed)
+    columns = int(np.ceil(np.sqrt(config.regions))) if config.regions else 1
+    rows = int(np.ceil(config.regions / columns)) if config.regions else 1
+    cell_width, cell_height = config.width / columns, config.height / rows
+    text_types = [t.value for t in TextPageXMLTypes]
+    graphic_types = [t.value for t in GraphicRegionPageXMLTypes]
+
+    elements = ['<?xml version="1.0" encoding="UTF-8"?>',
+                '<PcGts xmlns="{}">'.format(version.get_namespace()),
+                '<Metadata><Creator>pagexml_mask_converter.synthetic</Creator></Metadata>',
+                '<Page imageFilename={} imageWidth="{}" imageHeight="{}">'.format(
+                    quoteattr(image_filename), config.width, config.height)]
+    line_index = 0
+    for index in range(config.regions):
+        row, column = divmod(index, columns)
+        x0 = column * cell_width + rng.uniform(0.02, 0.1) * cell_width
+        y0 = row * cell_height + rng.uniform(0.02, 0.1) * cell_height
+        x1 = (column + 1) * cell_width - rng.uniform(0.02, 0.1) * cell_width
+        y1 = (row + 1) * cell_height - rng.uniform(0.02, 0.1) * cell_height
+        region = _REGIONS[index % len(_REGIONS)]
+        r_type = ''
+        if region == 'TextRegion':
+            r_type = ' type="{}"'.format(text_types[rng.integers(len(text_types))])
+        elif region == 'GraphicRegion':
+            r_type = ' type="{}"'.format(graphic_types[rng.integers(len(graphic_types))])
+        elements.append('<{} id="r{}"{}>'.format(region, index, r_type))
+        elements.append('<Coords points="{}"/>'.format(_ellipse(rng, x0, y0, x1, y1, config.vertices)))
+        if region == 'TextRegion' and config.lines:
+            line_height = (y1 - y0) / config.lines
+            for line in range(config.lines):
+                elements.extend(_line_elements(rng, x0, y0 + line * line_height, x1, y0 + (line + 1) * line_height,
+                                               config, line_index))
+                line_index += 1
+        elements.append('</{}>'.format(region))
+    elements.extend(['</Page>', '</PcGts>', ''])
+    return '\n'.join(elements)
+
+
+def write_corpus(directory: str, num_pages: int, config: SyntheticPageConfig = None,
+                 versions: Sequence[PCGTSVersion] = tuple(PCGTSVersion), seed: int = 0) -> List[str]:
+    """
+    Writes num_pages synthetic pages page_<n>.xml to directory, cycling through the namespaces of versions.
+    Returns the paths of the files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for index in range(num_pages):
+        name = 'page_{:06d}'.format(index)
+        path = os.path.join(directory, name + '.xml')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(generate_page(config, versions[index % len(versions)], name + '.png', seed=seed + index))
+        files.append(path)
+    return files
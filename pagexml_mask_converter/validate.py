@@ -0,0 +1,107 @@
+import json
+import multiprocessing
+import sys
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple
+
+import numpy as np
+
+from pagexml_mask_converter.data import ColorTable
+from pagexml_mask_converter.pagexml_to_mask import REGION_TYPES, MaskType, parse_page_xml
+
+_worker_mask_types: List[MaskType] = None
+_worker_color_table: ColorTable = None
+
+
+class FileReport(NamedTuple):
+    file: str
+    problems: List[Dict]
+    polygons: int = 0
+    points: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+    def to_dict(self) -> Dict:
+        return {'file': self.file, 'ok': self.ok, 'polygons': self.polygons, 'points': self.points,
+                'problems': self.problems}
+
+
+def validate_file(file: str, mask_types: List[MaskType], color_table: ColorTable = None) -> FileReport:
+    """
+    Parses file as it would be parsed for mask_types, without rendering, and reports its problems, see
+    parse_page_xml. With a color_table, region types that are not part of it are reported as well.
+    """
+    problems = []
+    try:
+        page = parse_page_xml(file, mask_types, problems=problems)
+    except ET.ParseError as e:
+        return FileReport(file, problems + [{'problem': 'xml_error', 'element': None, 'message': str(e)}])
+    except Exception as e:
+        return FileReport(file, problems + [{'problem': 'error', 'element': None,
+                                             'message': '{}: {}'.format(type(e).__name__, e)}])
+    if page is None:
+        return FileReport(file, problems)
+    if color_table is not None and page.num_polygons:
+        pairs, counts = np.unique(np.stack([page.region_codes, page.type_codes], axis=1), axis=0,
+                                  return_counts=True)
+        for (region_code, type_code), count in zip(pairs.tolist(), counts.tolist()):
+            region = REGION_TYPES[region_code]
+            r_type = page.r_types[type_code] if type_code >= 0 else None
+            if (region, r_type) not in color_table.type_classes:
+                problems.append({'problem': 'unknown_type', 'element': None,
+                                 'message': "{} not known for region {} ({} polygons)".format(r_type, region, count)})
+    return FileReport(file, problems, page.num_polygons, len(page.coords))
+
+
+def _init_worker(mask_types: List[MaskType], color_table: ColorTable):
+    global _worker_mask_types, _worker_color_table
+    _worker_mask_types = mask_types
+    _worker_color_table = color_table
+
+
+def _validate(file: str) -> FileReport:
+    return validate_file(file, _worker_mask_types, _worker_color_table)
+
+
+def iter_reports(files: Iterable[str], mask_types: List[MaskType], color_table: ColorTable = None,
+                 processes: int = 4, chunksize: int = 8) -> Iterable[FileReport]:
+    """
+    Validates files on processes worker processes (<= 1 validates in this process) and yields a FileReport
+    per file in completion order. files may be any iterable, it is consumed lazily.
+    """
+    if processes <= 1:
+        for file in files:
+            yield validate_file(file, mask_types, color_table)
+        return
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(mask_types, color_table)) as pool:
+        yield from pool.imap_unordered(_validate, files, chunksize=chunksize)
+
+
+def validate(files: Iterable[str], report_file: str, mask_types: List[MaskType], color_table: ColorTable = None,
+             processes: int = 4, chunksize: int = 8, all_files: bool = False) -> Dict:
+    """
+    Validates files and writes the report of every file with problems (with all_files of every file) to
+    report_file as a line of json, "-" writes to stdout. Returns a summary with the number of files checked,
+    the number of files with problems and the number of files per problem.
+    """
+    start = time.perf_counter()
+    checked, failed = 0, 0
+    problem_files = Counter()
+    output = open(report_file, 'w') if report_file != '-' else sys.stdout
+    try:
+        for report in iter_reports(files, mask_types, color_table, processes=processes, chunksize=chunksize):
+            checked += 1
+            if not report.ok:
+                failed += 1
+                problem_files.update({problem['problem'] for problem in report.problems})
+            if all_files or not report.ok:
+                output.write(json.dumps(report.to_dict()) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return {'files': checked, 'files_with_problems': failed, 'seconds': time.perf_counter() - start,
+            'problems': dict(problem_files.most_common())}
@@ -0,0 +1,134 @@
+import io
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List
+
+from PIL import Image
+
+from pagexml_mask_converter.stats import RunStats, timed
+
+
+@dataclass
+class EncoderOptions:
+    """
+    Options of the image encoders, None keeps PIL's default.
+    """
+    png_compress_level: int = None
+    webp_lossless: bool = False
+    tiff_compression: str = None
+
+    def save_kwargs(self, extension: str) -> Dict:
+        extension = extension.lower().lstrip('.')
+        if extension == 'png' and self.png_compress_level is not None:
+            return {'compress_level': self.png_compress_level}
+        if extension == 'webp' and self.webp_lossless:
+            return {'lossless': True}
+        if extension in ('tif', 'tiff') and self.tiff_compression is not None:
+            return {'compression': self.tiff_compression}
+        return {}
+
+
+class MaskWriter:
+    """
+    Encodes and writes mask images. A mask is written to a temporary file that is renamed when it is
+    complete, so an existing mask file is never a partial one.
+    With stats, the time spent on encoding and on writing is recorded, see pop_stats.
+    """
+
+    def __init__(self, options: EncoderOptions = None, stats: RunStats = None):
+        self.options = options if options is not None else EncoderOptions()
+        self.stats = stats
+        self._submitted: List[Future] = []
+
+    def write(self, image: Image, path: str):
+        name, extension = os.path.splitext(path)
+        tmp_path = '{}.tmp{}-{}{}'.format(name, os.getpid(), threading.get_ident(), extension)
+        try:
+            # encoded in memory first, so that encoding and disk time can be told apart
+            with timed(self.stats, 'encode'):
+                data = io.BytesIO()
+                image.save(data, format=Image.registered_extensions().get(extension.lower()),
+                           **self.options.save_kwargs(extension))
+            with timed(self.stats, 'write'):
+                with open(tmp_path, 'wb') as f:
+                    f.write(data.getbuffer())
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def submit(self, image: Image, path: str) -> Future:
+        """
+        Writes image to path and returns a future of the write.
+        """
+        future = Future()
+        try:
+            self.write(image, path)
+            future.set_result(path)
+        except Exception as e:
+            future.set_exception(e)
+        self._submitted.append(future)
+        return future
+
+    def pop_stats(self) -> RunStats:
+        """
+        Stats of the writes since the last call, None without stats. Writes still running may be
+        recorded in the stats of the next call.
+        """
+        stats = self.stats
+        if stats is not None:
+            self.stats = RunStats()
+        return stats
+
+    def pop_submitted(self) -> List[Future]:
+        """
+        Futures of the writes submitted since the last call.
+        """
+        submitted, self._submitted = self._submitted, []
+        return submitted
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class AsyncMaskWriter(MaskWriter):
+    """
+    Encodes and writes masks on a pool of threads, while the caller goes on rendering.
+    PIL releases the GIL while compressing and writing, so encoding, I/O and rendering overlap.
+    At most max_pending masks are waiting or being written, submit blocks until one is finished,
+    which bounds the memory held by rendered masks.
+    """
+
+    def __init__(self, options: EncoderOptions = None, threads: int = 2, max_pending: int = 8,
+                 stats: RunStats = None):
+        super().__init__(options, stats)
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='mask-writer')
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+
+    def _write(self, image, path):
+        try:
+            self.write(image, path)
+            return path
+        finally:
+            self._slots.release()
+
+    def submit(self, image: Image, path: str) -> Future:
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._write, image, path)
+        except Exception:
+            self._slots.release()
+            raise
+        self._submitted.append(future)
+        return future
+
+    def close(self):
+        self._executor.shutdown(wait=True)
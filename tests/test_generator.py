@@ -0,0 +1,34 @@
+import logging
+
+import numpy as np
+
+from pagexml_mask_converter.pagexml_to_mask import MaskGenerator, MaskSetting
+from pagexml_mask_converter.stats import ClassCounts
+
+NAMESPACE = 'http://schema.primaresearch.org/PAGE/gts/pagecontent/2017-07-15'
+
+
+def test_get_mask_logs_unknown_types_once(tmp_path, caplog):
+    path = tmp_path / 'page.xml'
+    path.write_text('<PcGts xmlns="{}"><Page imageFilename="page.png" imageWidth="100" imageHeight="50">'
+                    '<TextRegion id="r1" type="no-such-type"><Coords points="1,1 50,1 50,40"/></TextRegion>'
+                    '</Page></PcGts>'.format(NAMESPACE))
+    generator = MaskGenerator(MaskSetting())
+    with caplog.at_level(logging.WARNING):
+        generator.get_mask(str(path))
+        generator.get_mask(str(path))
+    assert [record.getMessage().count('no-such-type in TextRegion') for record in caplog.records] == [1]
+    assert not generator.pop_unknown_types()
+
+
+def test_class_counts_are_updated_per_page():
+    earlier, current = ClassCounts(), ClassCounts()
+    earlier.add_counts('all_types.1', 'a', np.array([5, 1]))
+    earlier.add_counts('all_types.1', 'b', np.array([2, 0, 4]))
+    earlier.add_counts('all_types.1', 'c', np.array([6]))
+    current.add_counts('all_types.1', 'a', np.array([3, 3]))
+    updated = ClassCounts.from_dict(earlier.to_dict()).updated(current, pages={'a', 'b'})
+    expected = ClassCounts()
+    expected.add_counts('all_types.1', 'b', np.array([2, 0, 4]))
+    expected.add_counts('all_types.1', 'a', np.array([3, 3]))
+    assert updated.to_dict() == expected.to_dict()
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pytest
+
+from pagexml_mask_converter.driver import run
+from pagexml_mask_converter.manifest import Manifest
+from pagexml_mask_converter.packed import PackedMasks
+from pagexml_mask_converter.pagexml_to_mask import MaskGenerator, MaskSetting, MaskType
+from pagexml_mask_converter.rle import RLEMasks
+from pagexml_mask_converter.synthetic import SyntheticPageConfig, write_corpus
+
+READERS = {'packed': PackedMasks, 'rle': RLEMasks}
+
+
+def convert(files, output_dir, output_format):
+    generator = MaskGenerator(MaskSetting(MASK_TYPE=MaskType.ALLTYPES, LABEL_MAP=True))
+    with Manifest(output_dir, generator.to_dict()) as manifest:
+        report = run(generator, files, output_dir, processes=1, progress=False, manifest=manifest,
+                     output_format=output_format)
+        removed = manifest.prune()
+    assert not report.failures
+    return report, removed
+
+
+@pytest.mark.parametrize('output_format', ['packed', 'rle'])
+def test_prune_keeps_the_shards_of_other_pages(tmp_path, output_format):
+    config = SyntheticPageConfig(width=300, height=400, regions=4, lines=2, words=False)
+    files = write_corpus(str(tmp_path / 'xml'), 4, config)
+    output_dir = str(tmp_path / 'out') + os.sep
+    convert(files, output_dir, output_format)
+    expected = {name: np.array(READERS[output_format](output_dir)[name])
+                for name in READERS[output_format](output_dir).names()}
+    assert len(expected) == 4
+
+    os.remove(files[1])
+    report, removed = convert(files[:1] + files[2:], output_dir, output_format)
+    assert report.skipped == 3
+    assert removed == []
+    masks = READERS[output_format](output_dir)
+    for name, mask in expected.items():
+        if name != 'page_000001.mask':
+            np.testing.assert_array_equal(masks[name], mask)
+
+
+
+def test_manifest_creates_the_output_directory(tmp_path):
+    directory = str(tmp_path / 'new' / 'out')
+    Manifest(directory, {'settings': 1}).close()
+    assert os.path.exists(os.path.join(directory, 'manifest.jsonl'))
+
+
+def test_files_with_the_same_output_name_fail(tmp_path):
+    config = SyntheticPageConfig(width=300, height=400, regions=4, lines=2, words=False)
+    first = write_corpus(str(tmp_path / 'xml' / 'a'), 1, config)
+    second = write_corpus(str(tmp_path / 'xml' / 'b'), 1, config)
+    output_dir = str(tmp_path / 'out') + os.sep
+    generator = MaskGenerator(MaskSetting(MASK_TYPE=MaskType.ALLTYPES))
+    with Manifest(output_dir, generator.to_dict()) as manifest:
+        report = run(generator, first + second, output_dir, processes=1, progress=False, manifest=manifest)
+        assert list(manifest.entries) == [os.path.abspath(file) for file in first]
+    assert [failure.file for failure in report.failures] == second
+    assert 'Duplicate output name' in report.failures[0].error
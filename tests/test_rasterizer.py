@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from pagexml_mask_converter.pagexml_to_mask import MaskSetting, MaskType, page_region_to_mask, parse_page_xml
+from pagexml_mask_converter.rasterizer import DrawList, RasterizerBackend, compare_rasterizers
+from pagexml_mask_converter.synthetic import SyntheticPageConfig, generate_page
+
+PAGE_SIZE = (240, 160)
+
+
+@pytest.fixture(scope='module', params=[0, 1])
+def page(request, tmp_path_factory):
+    path = tmp_path_factory.mktemp('xml') / 'page_{}.xml'.format(request.param)
+    config = SyntheticPageConfig(width=600, height=800, regions=7, lines=4, vertices=9, words=False)
+    path.write_text(generate_page(config, image_filename=path.stem + '.png', seed=request.param))
+    return parse_page_xml(str(path), list(MaskType))
+
+
+@pytest.mark.parametrize('mask_type', list(MaskType))
+@pytest.mark.parametrize('scale', [1.0, 0.5, 0.33])
+@pytest.mark.parametrize('window', [None, (37, 51, 180, 230), (-20, 700, 300, 300)])
+def test_backends_render_the_same_page(page, mask_type, scale, window):
+    masks = [np.asarray(page_region_to_mask(page, MaskSetting(MASK_TYPE=mask_type, LABEL_MAP=True,
+                                                              RASTERIZER=backend), scale, window=window))
+             for backend in RasterizerBackend]
+    assert masks[0].shape == masks[1].shape
+    if window is None:
+        assert masks[0].any()
+    assert np.count_nonzero(masks[0] != masks[1]) == 0
+
+
+@pytest.mark.parametrize('width', [0, 1, 2, 3, 4, 5, 8])
+@pytest.mark.parametrize('shape', [
+    [(10, 10)],
+    [(10, 10), (10, 10)],
+    [(10, 10), (60, 35)],
+    [(5, 100), (200, 100)],
+    [(70, 5), (70, 150)],
+    [(10, 10), (60, 10), (60, 10), (35, 50)],
+    [(-30, -20), (100, 40), (300, 200)],
+    [(-50, 80), (120, -40), (290, 80), (120, 210)],
+    [(250, 10), (400, 10), (400, 100)],
+    [(20, 20), (100, 20), (100, 100), (60, 60), (20, 100)],
+    [(20, 20), (120, 120), (20, 120), (120, 20)],
+])
+def test_backends_draw_degenerate_shapes_the_same(shape, width):
+    draw_list = DrawList.from_shapes([shape], [1], [width])
+    assert compare_rasterizers(draw_list, PAGE_SIZE) == 0
+    assert compare_rasterizers(draw_list, PAGE_SIZE, window=(15, 25, 90, 70)) == 0
+
+
+def test_backends_draw_overlapping_shapes_in_order():
+    draw_list = DrawList.from_shapes([[(10, 10), (150, 10), (150, 120), (10, 120)],
+                                      [(40, 5), (200, 90)],
+                                      [(60, 60), (230, 60), (145, 150)]], [1, 2, 3], [0, 5, 0])
+    assert compare_rasterizers(draw_list, PAGE_SIZE) == 0
+
+
+@pytest.mark.parametrize('mask_type', list(MaskType))
+@pytest.mark.parametrize('window', [None, (37, 51, 180, 230)])
+def test_rgb_masks_are_the_colored_label_maps(page, mask_type, window):
+    for backend in RasterizerBackend:
+        setting = MaskSetting(MASK_TYPE=mask_type, RASTERIZER=backend)
+        label_map = page_region_to_mask(page, MaskSetting(MASK_TYPE=mask_type, LABEL_MAP=True, RASTERIZER=backend),
+                                        window=window)
+        rgb = page_region_to_mask(page, setting, window=window)
+        assert rgb.mode == 'RGB'
+        assert np.array_equal(np.asarray(rgb), np.asarray(label_map.convert('RGB')))
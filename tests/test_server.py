@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+from pagexml_mask_converter.pagexml_to_mask import MaskGenerator, MaskSetting, MaskType
+from pagexml_mask_converter.server import MaskServer, PageNotFound
+from pagexml_mask_converter.synthetic import SyntheticPageConfig, write_corpus
+
+
+@pytest.fixture
+def server(tmp_path):
+    files = write_corpus(str(tmp_path), 2, SyntheticPageConfig(width=300, height=400, regions=4, lines=2))
+    return MaskServer(MaskGenerator(MaskSetting()), files=files, threads=2)
+
+
+def test_concurrent_requests_compute_once_and_miss_once(server):
+    async def requests():
+        page_id = next(iter(server.sources))
+        return await asyncio.gather(*[server.get_mask(page_id, MaskType.ALLTYPES) for _ in range(16)])
+
+    assert len(set(asyncio.run(requests()))) == 1
+    for cache in (server.pages, server.masks):
+        assert (cache.hits, cache.misses) == (15, 1)
+
+
+def test_unknown_pages_are_not_found(server):
+    with pytest.raises(PageNotFound):
+        asyncio.run(server.respond('/mask/no-such-page'))
+    assert asyncio.run(server.respond('/no-such-endpoint'))[0] == 404
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from pagexml_mask_converter.rasterizer import DrawList, RasterizerBackend
+from pagexml_mask_converter.simplify import simplify_polygons
+
+PAGE_SIZE = (220, 140)
+
+
+def redundant_shapes(count, seed=0):
+    """
+    Random shapes with repeated vertices and vertices inserted into their horizontal and vertical edges.
+    """
+    rng = np.random.default_rng(seed)
+    shapes = []
+    for _ in range(count):
+        points = rng.integers(-10, 230, (rng.integers(2, 7), 2)) % (230, 150)
+        # make some edges horizontal or vertical
+        for i in range(1, len(points)):
+            if rng.random() < 0.5:
+                axis = rng.integers(2)
+                points[i, axis] = points[i - 1, axis]
+        shape = [points[0]]
+        for a, b in zip(points[:-1], points[1:]):
+            if (a == b).any() and rng.random() < 0.7:
+                shape.extend(a + (b - a) * t // 4 for t in range(1, 4))
+            shape.append(b)
+            if rng.random() < 0.2:
+                shape.append(b)
+        shapes.append(np.array(shape))
+    return shapes
+
+
+def render(shape, width, backend):
+    draw_list = DrawList.from_shapes([shape], [1], [width])
+    return np.asarray(backend.get_rasterizer().render(draw_list, PAGE_SIZE, (0, 0) + PAGE_SIZE))
+
+
+@pytest.mark.parametrize('backend', list(RasterizerBackend))
+@pytest.mark.parametrize('width', [0, 1, 2, 3, 4, 5])
+def test_tolerance_zero_does_not_change_masks(backend, width):
+    for shape in redundant_shapes(150, seed=width):
+        keep, offsets = simplify_polygons(shape, np.array([0, len(shape)]), lines=width > 0)
+        assert offsets[-1] == keep.sum()
+        np.testing.assert_array_equal(render(shape[keep], width, backend), render(shape, width, backend))
+
+
+def test_tolerance_zero_keeps_diagonal_vertices():
+    shape = np.array([[176, 81], [27, 68], [68, 29], [42, 41], [3, 59]])
+    keep, _ = simplify_polygons(shape, np.array([0, len(shape)]))
+    assert keep.all()
+    keep, _ = simplify_polygons(shape, np.array([0, len(shape)]), tolerance=0.5)
+    assert shape[keep].tolist() == [[176, 81], [27, 68], [68, 29], [3, 59]]
+
+
+def test_duplicates_and_axis_aligned_vertices_are_removed():
+    coords = np.array([[0, 0], [0, 0], [5, 0], [10, 0], [10, 5], [10, 10], [0, 10], [0, 10], [1, 1], [2, 2]])
+    offsets = np.array([0, 8, 8, 10])
+    keep, new_offsets = simplify_polygons(coords, offsets)
+    # the last vertex is kept even if it repeats the one before
+    assert coords[keep].tolist() == [[0, 0], [10, 0], [10, 10], [0, 10], [0, 10], [1, 1], [2, 2]]
+    assert new_offsets.tolist() == [0, 5, 5, 7]
+    keep, _ = simplify_polygons(coords, offsets, lines=True)
+    assert coords[keep].tolist() == [[0, 0], [0, 0], [10, 0], [10, 10], [0, 10], [0, 10], [1, 1], [2, 2]]
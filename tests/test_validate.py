@@ -0,0 +1,75 @@
+import pytest
+
+from pagexml_mask_converter.pagexml_to_mask import MaskType, parse_page_xml, points_to_array
+from pagexml_mask_converter.validate import validate_file
+
+NAMESPACE = 'http://schema.primaresearch.org/PAGE/gts/pagecontent/2017-07-15'
+
+
+def write_page(path, regions, namespace=NAMESPACE, size='imageWidth="100" imageHeight="50"'):
+    path.write_text('<PcGts xmlns="{}"><Page imageFilename="{}.png" {}>{}</Page></PcGts>'.format(
+        namespace, path.stem, size, regions))
+    return str(path)
+
+
+def problems_of(report):
+    return sorted((problem['problem'], problem['element']) for problem in report.problems)
+
+
+@pytest.mark.parametrize('points', [['1,2,3 4,5 6'], ['1,2,3', '4,5 6'], ['1,2 3'], ['1,x 2,3'], ['1, 2']])
+def test_malformed_points_are_rejected(points):
+    with pytest.raises(ValueError):
+        points_to_array(points)
+
+
+def test_points_are_parsed():
+    coords, counts = points_to_array(['1,2  3,4\t5,-6', '', ' 7,8 '])
+    assert coords.tolist() == [[1, 2], [3, 4], [5, -6], [7, 8]]
+    assert counts.tolist() == [3, 0, 1]
+
+
+def test_valid_page_has_no_problems(tmp_path):
+    file = write_page(tmp_path / 'good.xml', '<TextRegion id="r1" type="paragraph"><Coords points="1,1 50,1 50,40"/>'
+                                             '<TextLine id="l1"><Baseline points="2,9 40,9"/></TextLine></TextRegion>')
+    report = validate_file(file, list(MaskType))
+    assert report.ok
+    assert report.polygons == 2
+
+
+def test_problems_are_reported_per_element(tmp_path):
+    file = write_page(tmp_path / 'bad.xml',
+                      '<TextRegion id="r1"><Coords points="1,2,3 4,5 6"/>'
+                      '<TextLine id="l1"><Coords points="2,2 400,2 40,10"/><Baseline points="2,9"/></TextLine>'
+                      '</TextRegion><TextRegion id="r2"><Coords points="1,2,3"/></TextRegion>'
+                      '<TextRegion id="r3"><Coords points="4,5 6,7 8"/></TextRegion>'
+                      '<FooRegion id="f1"/>')
+    assert problems_of(validate_file(file, list(MaskType))) == [
+        ('bad_points', 'r1'), ('bad_points', 'r2'), ('bad_points', 'r3'), ('out_of_bounds', 'l1'),
+        ('too_few_points', 'l1'), ('unknown_region', 'f1')]
+    with pytest.raises(ValueError):
+        parse_page_xml(file, list(MaskType))
+
+
+def test_page_level_problems(tmp_path):
+    assert problems_of(validate_file(write_page(tmp_path / 'ns.xml', '', namespace='urn:x'), [MaskType.ALLTYPES])) \
+        == [('unknown_namespace', None)]
+    assert problems_of(validate_file(write_page(tmp_path / 'size.xml', '', size=''), [MaskType.ALLTYPES])) \
+        == [('bad_image_size', None)]
+    (tmp_path / 'nopage.xml').write_text('<PcGts xmlns="{}"/>'.format(NAMESPACE))
+    assert problems_of(validate_file(str(tmp_path / 'nopage.xml'), [MaskType.ALLTYPES])) == [('missing_page', None)]
+    (tmp_path / 'broken.xml').write_text('<PcGts')
+    assert problems_of(validate_file(str(tmp_path / 'broken.xml'), [MaskType.ALLTYPES])) == [('xml_error', None)]
+
+
+def test_skipped_subtrees_do_not_end_the_region(tmp_path):
+    file = write_page(tmp_path / 'nested.xml',
+                      '<ReadingOrder><OrderedGroup id="g1"><OrderedGroup id="g2"/></OrderedGroup></ReadingOrder>'
+                      '<TextRegion id="r1"><TextRegion id="r2"><Coords points="1,1 5,1 5,5"/></TextRegion>'
+                      '<Coords points="1,1 50,1 50,40"/><TextLine id="l1"><Word id="w1"><Coords points="3,3 4,4 3,4"/>'
+                      '<Glyph id="g"><TextEquiv><Unicode>a</Unicode></TextEquiv></Glyph></Word>'
+                      '<Coords points="2,2 20,2 20,20"/><Baseline points="2,20 20,20"/></TextLine></TextRegion>'
+                      '<ImageRegion id="i1"><Coords points="60,10 70,10 70,20"/></ImageRegion>')
+    assert parse_page_xml(file, MaskType.ALLTYPES).coords.tolist() == [[1, 1], [50, 1], [50, 40], [60, 10],
+                                                                       [70, 10], [70, 20]]
+    assert parse_page_xml(file, MaskType.TEXT_LINE).coords.tolist() == [[2, 2], [20, 2], [20, 20]]
+    assert parse_page_xml(file, MaskType.BASE_LINE).coords.tolist() == [[2, 20], [20, 20]]